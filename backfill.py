@@ -0,0 +1,114 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Optional
+
+from lead_mappings import card_index
+from metrics import metrics
+from sync_diff import normalize_sheet_row, normalize_card, sheet_row_fingerprint
+from sync_logic import SHEET_TO_TRELLO, TRELLO_TO_SHEET, card_title, card_desc, mapping_record
+
+logger = logging.getLogger("sync")
+
+# Card titles end with "(LeadID: <sid>)"; see sync_logic.card_title.
+LEAD_ID_SUFFIX = re.compile(r"\(LeadID:\s*([^()]*?)\s*\)\s*$")
+
+
+def lead_id_from_title(title: str) -> Optional[str]:
+    m = LEAD_ID_SUFFIX.search(title or "")
+    return m.group(1) if m and m.group(1) else None
+
+
+def index_board_by_lead_id(trello, skip_card_ids=()) -> Dict[str, dict]:
+    # sid -> open card whose title carries that LeadID, leaving out cards already mapped.
+    cards: Dict[str, dict] = {}
+    for card in trello.iter_cards_on_board():
+        sid = lead_id_from_title(card.get("name"))
+        if sid is None or card.get("id") in skip_card_ids:
+            continue
+        if sid in cards:
+            logger.warning("Cards %s and %s both carry LeadID %s; using %s", cards[sid]["id"], card.get("id"),
+                           sid, cards[sid]["id"])
+            continue
+        cards[sid] = card
+    return cards
+
+
+def backfill_sheet_to_trello(sheet, trello, mappings, state, save_state_callback, data_json_path,
+                             max_workers=8, batch_size=500):
+    # One-off import of a sheet into a board without going through the per-row sync:
+    #  - rows whose lead already has an open "(LeadID: N)" card are mapped to that card, no API call;
+    #  - the rest get their card created on a thread pool (the client's rate limiter still applies);
+    #  - state is saved every batch_size new mappings rather than per lead.
+    # Leads mapped by an earlier (possibly crashed) run are skipped, and cards it created after its
+    # last checkpoint are picked up again by their title, so re-running resumes without duplicates.
+    # The adopted mappings hold the card's values, so the next normal pass pushes any sheet edits.
+    if not trello.lists:
+        trello.get_lists_by_name()
+    list_id_to_name = {v: k for k, v in trello.lists.items()}
+    existing = index_board_by_lead_id(trello, skip_card_ids=set(card_index(mappings)))
+    logger.info("Backfill: %d unmapped cards on the board carry a LeadID", len(existing))
+
+    stats = {"adopted": 0, "created": 0, "skipped": 0, "failed": 0}
+    unsaved = 0
+
+    def checkpoint(force=False):
+        nonlocal unsaved
+        if unsaved and (force or unsaved >= batch_size):
+            save_state_callback(data_json_path, state)
+            unsaved = 0
+            logger.info("Backfill checkpoint: %s", stats)
+
+    def record(sid, card_id, lead, sheet_hash=None):
+        nonlocal unsaved
+        mappings[sid] = mapping_record(card_id, lead, sheet_hash)
+        unsaved += 1
+        checkpoint()
+
+    def collect(future, sid, lead, row_hash):
+        try:
+            card_id = future.result()
+        except Exception as e:
+            stats["failed"] += 1
+            metrics.inc("backfill_leads_total", outcome="failed")
+            logger.error("Backfill: failed creating card for sheet id=%s: %s", sid, e, exc_info=e)
+            return
+        stats["created"] += 1
+        metrics.inc("backfill_leads_total", outcome="created")
+        record(sid, card_id, lead, row_hash)
+
+    seen = set()
+    inflight = {}  # future -> (sid, lead, row_hash)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for row in sheet.iter_rows():
+            lead = normalize_sheet_row(row)
+            if lead is None or lead["id"] in mappings or lead["id"] in seen:
+                continue
+            sid = lead["id"]
+            seen.add(sid)
+
+            card = existing.get(sid)
+            if card is not None:
+                card_lead = normalize_card(card, list_id_to_name, TRELLO_TO_SHEET, trello.parse_desc_to_fields)
+                record(sid, card["id"], dict(lead, **card_lead))
+                stats["adopted"] += 1
+                metrics.inc("backfill_leads_total", outcome="adopted")
+                continue
+
+            list_name = SHEET_TO_TRELLO.get(lead["category"])
+            if not list_name:
+                # LOST (or unknown category) leads don't get a card, as in the normal sync.
+                stats["skipped"] += 1
+                continue
+            future = pool.submit(trello.create_card, list_name, card_title(lead), card_desc(trello, lead))
+            inflight[future] = (sid, lead, sheet_row_fingerprint(row))
+            if len(inflight) >= max_workers * 2:
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for f in done:
+                    collect(f, *inflight.pop(f))
+        for f in list(inflight):
+            collect(f, *inflight.pop(f))
+
+    checkpoint(force=True)
+    logger.info("Backfill finished: %s", stats)
+    return stats
@@ -0,0 +1,93 @@
+# Card description parse/render cost: the former line-by-line parser vs desc_codec, for both formats.
+#
+#   python -m benchmarks.bench_desc [--count 100000] [--repeat 3]
+#
+# "legacy" is a copy of what TrelloClient did before desc_codec: splitlines + split(":") per line and
+# an uncompiled re.search for the email, and a render that scanned the field keys once per label.
+import argparse
+import re
+import time
+
+from desc_codec import parse_desc, render_desc
+
+
+def legacy_parse(desc):
+    result = {}
+    if not desc:
+        return result
+    for line in desc.splitlines():
+        if ":" not in line:
+            continue
+        key, val = line.split(":", 1)
+        k = key.strip().lower()
+        v = val.strip()
+        if v == "":
+            continue
+        if k == "email":
+            m = re.search(r'([A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,})', v)
+            result[k] = m.group(1) if m else v
+        elif k in ("note", "source"):
+            result[k] = v
+    return result
+
+
+def legacy_render(fields):
+    lowered = {k.strip().lower(): v for k, v in fields.items()}
+    canon = {}
+    if "email" in lowered:
+        canon["Email"] = lowered["email"]
+    if "note" in lowered:
+        canon["Note"] = lowered["note"]
+    if "source" in lowered:
+        canon["Source"] = lowered["source"]
+    parts = []
+    if any(k.lower() == "email" for k in canon.keys()):
+        parts.append(f"Email: {canon.get('email') or canon.get('Email')}")
+    if any(k.lower() == "note" for k in canon.keys()):
+        parts.append(f"Note: {canon.get('note') or canon.get('Note')}")
+    if any(k.lower() == "source" for k in canon.keys()):
+        parts.append(f"Source: {canon.get('source') or canon.get('Source')}")
+    return "\n".join(parts)
+
+
+def build(n):
+    return [{"Email": f"lead{i}@example.com", "Note": f"Called on day {i % 30}, follow up", "Source": "Web"}
+            for i in range(n)]
+
+
+def best(fn, items, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Card description parse/render micro-benchmark")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    fields = build(args.count)
+    lines = [render_desc(f, "lines") for f in fields]
+    blocks = [render_desc(f, "json") for f in fields]
+    assert all(legacy_parse(d) == parse_desc(d) for d in lines[:1000])
+
+    rows = [
+        ("parse  legacy", best(legacy_parse, lines, args.repeat)),
+        ("parse  lines", best(parse_desc, lines, args.repeat)),
+        ("parse  json", best(parse_desc, blocks, args.repeat)),
+        ("render legacy", best(legacy_render, fields, args.repeat)),
+        ("render lines", best(lambda f: render_desc(f, "lines"), fields, args.repeat)),
+        ("render json", best(lambda f: render_desc(f, "json"), fields, args.repeat)),
+    ]
+    print(f"{'':<14} {'total (s)':>10} {'per desc (us)':>14}")
+    for name, seconds in rows:
+        print(f"{name:<14} {seconds:>10.3f} {seconds / args.count * 1e6:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Per-cycle CPU cost of a no-op sync cycle with and without the stored sheet/card fingerprints.
+#
+#   python -m benchmarks.bench_fingerprints [--sizes 10000 100000] [--cycles 3]
+#
+# Everything runs in memory; "without" drops sheet_hash/card_hash before each cycle so every lead
+# goes through normalization, description parsing and the field diff as it did before fingerprints.
+import argparse
+import os
+import time
+
+os.environ.setdefault("TRELLO_API_KEY", "bench")
+os.environ.setdefault("TRELLO_TOKEN", "bench")
+os.environ.setdefault("TRELLO_BOARD_ID", "bench")
+
+from lead_mappings import MappingTable
+from sync_logic import sync_sheet_to_trello, sync_trello_to_sheet
+from task_client import TrelloClient
+
+LISTS = {"todo": "list-todo", "inprogress": "list-inprogress", "done": "list-done"}
+CATEGORIES = ("new", "contacted", "qualified")
+
+
+class BenchSheet:
+    def __init__(self, rows):
+        self.rows = rows
+        self.index = {str(r["id"]): i + 2 for i, r in enumerate(rows)}
+
+    def read_rows(self):
+        return self.rows
+
+    def iter_rows(self):
+        return iter(self.rows)
+
+    def find_row_index_by_id(self, sid):
+        return self.index.get(sid)
+
+    def queue_row_update(self, row_index, changes, key=None):
+        pass
+
+    def flush_updates(self):
+        return {}
+
+
+class BenchTrello(TrelloClient):
+    def __init__(self, cards):
+        super().__init__("bench", "bench", "bench")
+        self.cards = cards
+        self.lists = dict(LISTS)
+
+    def get_cards_on_board(self):
+        return self.cards
+
+    def iter_cards_on_board(self, page_size=0):
+        return iter(self.cards)
+
+    def get_lists_by_name(self):
+        return dict(LISTS)
+
+
+def build(n):
+    rows, cards, mappings = [], [], {}
+    list_for = {"new": "list-todo", "contacted": "list-inprogress", "qualified": "list-done"}
+    for i in range(n):
+        sid = str(i)
+        category = CATEGORIES[i % 3]
+        lead = {"id": i, "name": f"Lead {i}", "email": f"lead{i}@example.com", "category": category,
+                "note": f"Note for lead {i}", "source": "Web"}
+        rows.append(lead)
+        card_id = f"{i:024x}"
+        cards.append({"id": card_id, "name": f"Lead {i} (LeadID: {sid})", "idList": list_for[category],
+                      "desc": f"Email: lead{i}@example.com\nNote: Note for lead {i}\nSource: Web"})
+        mappings[sid] = {"card_id": card_id, "category": category, "name": f"Lead {i}",
+                         "email": f"lead{i}@example.com", "note": f"Note for lead {i}", "source": "Web"}
+    return rows, cards, MappingTable(mappings)
+
+
+def run(n, cycles, fingerprints):
+    rows, cards, mappings = build(n)
+    sheet, trello = BenchSheet(rows), BenchTrello(cards)
+    state = {"mappings": mappings}
+    save = lambda path, st: None
+
+    # Warm-up cycle stores the fingerprints.
+    sync_sheet_to_trello(sheet, trello, mappings, state, save, None)
+    sync_trello_to_sheet(sheet, trello, mappings, state, save, None)
+
+    timings = []
+    for _ in range(cycles):
+        if not fingerprints:
+            for mapped in mappings.values():
+                mapped.pop("sheet_hash", None)
+                mapped.pop("card_hash", None)
+        start = time.process_time()
+        sync_sheet_to_trello(sheet, trello, mappings, state, save, None)
+        sync_trello_to_sheet(sheet, trello, mappings, state, save, None)
+        timings.append(time.process_time() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="No-op sync cycle CPU cost with and without fingerprints")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--cycles", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8}  {'without (s)':>12}  {'with (s)':>10}  {'speedup':>8}")
+    for n in args.sizes:
+        without = run(n, args.cycles, fingerprints=False)
+        with_fp = run(n, args.cycles, fingerprints=True)
+        print(f"{n:>8}  {without:>12.3f}  {with_fp:>10.3f}  {without / with_fp:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# One sheet -> Trello -> sheet sync cycle against the in-memory fakes, at several sizes and change rates.
+#
+#   python -m benchmarks.bench_sync [--sizes 100 10000 100000] [--change-rates 0 0.01 0.1] [--cold]
+#                                   [--backend sqlite|json] [--commit lead|cycle] [--workers N]
+#                                   [--latency S] [--failure-rate P] [--rate-limit-rate P] [--json out.json]
+#
+# Each scenario builds a sheet, board and state already in sync, runs one warm-up cycle (stores the
+# fingerprints), then edits change_rate of the leads (half on the sheet, half on the board) and times
+# one cycle. --cold starts from an empty state and board instead, so every lead is created.
+# Scenarios run in separate processes so the peak RSS column belongs to that scenario alone (it
+# includes building the fixtures). "state KB" is bytes written by state saves during the timed cycle:
+# the JSON file per write, or the SQLite WAL frames.
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import logging
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("TRELLO_API_KEY", "bench")
+os.environ.setdefault("TRELLO_TOKEN", "bench")
+os.environ.setdefault("TRELLO_BOARD_ID", "bench")
+
+LIST_FOR = {"new": "TODO", "contacted": "INPROGRESS", "qualified": "DONE"}
+CATEGORIES = ("new", "contacted", "qualified")
+
+
+def build(n, cold, faults_sheet, faults_trello):
+    from benchmarks.fakes import FakeWorksheet, FakeTrelloBoard, HEADER
+
+    board = FakeTrelloBoard()
+    rows, mappings = [], {}
+    for i in range(n):
+        category = CATEGORIES[i % 3]
+        lead = {"id": str(i), "name": f"Lead {i}", "email": f"lead{i}@example.com", "category": category,
+                "note": f"Note for lead {i}", "source": "Web"}
+        rows.append([lead[h] for h in HEADER])
+        if cold:
+            continue
+        card = board.add_card(f"Lead {i} (LeadID: {i})", board.list_id(LIST_FOR[category]),
+                              f"Email: lead{i}@example.com\nNote: Note for lead {i}\nSource: Web", record=False)
+        mappings[str(i)] = {"card_id": card["id"], **{k: v for k, v in lead.items() if k != "id"}}
+    return FakeWorksheet(HEADER, rows, faults_sheet), board, mappings
+
+
+def apply_changes(ws, board, mappings, rate, rng):
+    # Half of the edits on the sheet (note), half on the board (alternately a list move and a desc edit).
+    k = round(len(ws.rows) * rate)
+    sids = rng.sample(range(len(ws.rows)), k) if k else []
+    for n, i in enumerate(sids):
+        if n % 2 == 0:
+            ws.rows[i][4] = f"Edited note {i}"
+        else:
+            card_id = mappings[str(i)]["card_id"]
+            if n % 4 == 1:
+                board.update_card(card_id, {"idList": board.list_id("DONE")})
+            else:
+                board.update_card(card_id, {"desc": f"Email: lead{i}@example.com\nNote: Card note {i}\nSource: Web"})
+    return k
+
+
+def _wal_bytes(store):
+    # Bytes of WAL frames written since the last checkpoint (autocheckpoint is off for the timed cycle).
+    page_size = store.conn.execute("PRAGMA page_size").fetchone()[0]
+    frames = store.conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()[1]
+    return max(frames, 0) * (page_size + 24)
+
+
+def run_scenario(params):
+    from benchmarks.fakes import Faults, fake_sheet_client, fake_trello_client
+    from state_store import open_state_store
+    from sync_logic import sync_sheet_to_trello, sync_trello_to_sheet
+
+    if not params["verbose"]:
+        # Injected failures would otherwise log a warning per retry.
+        logging.getLogger("sync").setLevel(logging.CRITICAL)
+    n, rate, cold = params["size"], params["change_rate"], params["cold"]
+    sheet_faults, trello_faults = Faults(seed=1), Faults(seed=2)
+    ws, board, mappings = build(n, cold, sheet_faults, trello_faults)
+
+    tmp = tempfile.mkdtemp(prefix="bench_sync_")
+    path = os.path.join(tmp, "state.db" if params["backend"] == "sqlite" else "state.json")
+    store = open_state_store(path, params["backend"])
+    store.save({"mappings": mappings})
+    state = store.load()
+    mappings = state["mappings"]
+
+    sheet, trello = fake_sheet_client(ws), fake_trello_client(board, trello_faults)
+    trello.ensure_list_map(["TODO", "INPROGRESS", "DONE"])
+
+    writes = {"count": 0, "bytes": 0}
+    real_write = store._write
+
+    def counting_write(st):
+        real_write(st)
+        writes["count"] += 1
+        if not hasattr(store, "conn"):
+            writes["bytes"] += os.path.getsize(path)
+
+    def cycle():
+        save = lambda _path, st: store.save(st)
+        if params["commit"] == "cycle":
+            with store.transaction():
+                c = sync_sheet_to_trello(sheet, trello, mappings, state, save, path, max_workers=params["workers"])
+                return c + sync_trello_to_sheet(sheet, trello, mappings, state, save, path)
+        c = sync_sheet_to_trello(sheet, trello, mappings, state, save, path, max_workers=params["workers"])
+        return c + sync_trello_to_sheet(sheet, trello, mappings, state, save, path)
+
+    if not cold:
+        cycle()
+        edited = apply_changes(ws, board, mappings, rate, random.Random(3))
+    else:
+        edited = n
+
+    for faults in (sheet_faults, trello_faults):
+        faults.reset()
+        faults.latency = params["latency"]
+        faults.failure_rate = params["failure_rate"]
+        faults.rate_limit_rate = params["rate_limit_rate"]
+    if hasattr(store, "conn"):
+        store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        store.conn.execute("PRAGMA wal_autocheckpoint=0")
+    store._write = counting_write
+
+    start = time.perf_counter()
+    changed = cycle()
+    wall = time.perf_counter() - start
+
+    if hasattr(store, "conn"):
+        writes["bytes"] = _wal_bytes(store)
+    store.close()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    return dict(params, edited=edited, changed=changed, wall_s=round(wall, 4),
+                sheet_calls=sum(sheet_faults.calls.values()), trello_calls=sum(trello_faults.calls.values()),
+                injected=sum(sheet_faults.injected.values()) + sum(trello_faults.injected.values()),
+                state_writes=writes["count"], state_bytes=writes["bytes"], peak_rss_mb=round(peak_mb, 1),
+                calls=dict(sheet_faults.calls + trello_faults.calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync cycle benchmark against in-memory Sheet/Trello fakes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--change-rates", type=float, nargs="+", default=[0.0, 0.01, 0.1])
+    parser.add_argument("--cold", action="store_true", help="start from empty state: every lead is created")
+    parser.add_argument("--backend", choices=("sqlite", "json"), default="sqlite")
+    parser.add_argument("--commit", choices=("lead", "cycle"), default="lead")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake API call")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of calls failing with 5xx")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the sync's log output")
+    args = parser.parse_args()
+
+    scenarios = []
+    for size in args.sizes:
+        for rate in ([1.0] if args.cold else args.change_rates):
+            scenarios.append(dict(size=size, change_rate=rate, cold=args.cold, backend=args.backend,
+                                  commit=args.commit, workers=args.workers, latency=args.latency,
+                                  failure_rate=args.failure_rate, rate_limit_rate=args.rate_limit_rate,
+                                  verbose=args.verbose))
+
+    print(f"{'leads':>7} {'change':>7} {'edited':>7} {'wall (s)':>9} {'sheet':>6} {'trello':>7} {'faults':>6} "
+          f"{'writes':>7} {'state KB':>9} {'peak MB':>8}")
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for params in scenarios:
+        with ctx.Pool(1) as pool:
+            r = pool.apply(run_scenario, (params,))
+        results.append(r)
+        print(f"{r['size']:>7} {r['change_rate']:>7.1%} {r['edited']:>7} {r['wall_s']:>9.3f} {r['sheet_calls']:>6} "
+              f"{r['trello_calls']:>7} {r['injected']:>6} {r['state_writes']:>7} {r['state_bytes'] / 1024:>9.1f} "
+              f"{r['peak_rss_mb']:>8.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+# In-memory stand-ins for the Google Sheets worksheet and the Trello REST API.
+#
+# The real GoogleSheetClient/TrelloClient run on top of them (FakeWorksheet is passed as `ws=`,
+# FakeTrelloSession as `session=`), so benchmarks exercise the clients' own indexing, batching,
+# paging and retry code. Every call is counted; latency, failures and 429s can be injected.
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from gspread.utils import a1_to_rowcol, numericise_all
+
+from http_utils import TokenBucket, RetryPolicy
+from lead_client import GoogleSheetClient
+from metrics import endpoint_label
+from task_client import TrelloClient
+
+HEADER = ["id", "name", "email", "category", "note", "source"]
+
+
+class Faults:
+    # latency: seconds added to every call; failure_rate / rate_limit_rate: probability that a call
+    # fails with a 5xx / 429 instead of running. Counts every call by name in `calls`.
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.injected: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def enter(self, name: str) -> Optional[int]:
+        # Records the call and returns the status to fail it with, or None to let it through.
+        with self.lock:
+            self.calls[name] += 1
+            roll = self.random.random()
+        if self.latency:
+            time.sleep(self.latency)
+        if roll < self.rate_limit_rate:
+            status = 429
+        elif roll < self.rate_limit_rate + self.failure_rate:
+            status = 503
+        else:
+            return None
+        with self.lock:
+            self.injected[status] += 1
+        return status
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.injected.clear()
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"fake sheets API error {status}")
+        self.status = status
+
+
+class FakeWorksheet:
+    # The gspread.Worksheet methods GoogleSheetClient uses, over a list of string rows.
+    def __init__(self, header: List[str], rows: List[List[str]], faults: Optional[Faults] = None):
+        self.header = list(header)
+        self.rows = [[str(v) for v in r] for r in rows]
+        self.faults = faults or Faults()
+
+    def _enter(self, name: str):
+        status = self.faults.enter(name)
+        if status is not None:
+            raise FakeAPIError(status)
+
+    def _row(self, row_index: int) -> List[str]:
+        return self.header if row_index == 1 else self.rows[row_index - 2]
+
+    @property
+    def row_count(self) -> int:
+        return len(self.rows) + 1
+
+    def get_all_records(self, empty2zero=False):
+        self._enter("get_all_records")
+        width = len(self.header)
+        return [dict(zip(self.header, numericise_all((r + [""] * width)[:width], empty2zero=empty2zero)))
+                for r in self.rows]
+
+    def row_values(self, row_index: int):
+        self._enter("row_values")
+        return list(self._row(row_index)) if row_index - 2 < len(self.rows) else []
+
+    def col_values(self, col: int):
+        self._enter("col_values")
+        return [r[col - 1] if col - 1 < len(r) else "" for r in [self.header] + self.rows]
+
+    def _range(self, a1: str) -> List[List[str]]:
+        start, _, end = a1.partition(":")
+        r1, c1 = a1_to_rowcol(start)
+        r2, c2 = a1_to_rowcol(end or start)
+        out = []
+        for row_index in range(r1, min(r2, self.row_count) + 1):
+            cells = self._row(row_index)[c1 - 1:c2]
+            while cells and cells[-1] == "":
+                cells = cells[:-1]
+            out.append(cells)
+        # The API leaves trailing empty rows out of the response.
+        while out and not out[-1]:
+            out.pop()
+        return out
+
+    def get(self, a1: str):
+        self._enter("get")
+        return self._range(a1)
+
+    def batch_get(self, ranges: List[str]):
+        self._enter("batch_get")
+        return [self._range(a1) for a1 in ranges]
+
+    def _set(self, row_index: int, col: int, value: Any):
+        while len(self.rows) < row_index - 1:
+            self.rows.append([""] * len(self.header))
+        row = self._row(row_index)
+        row.extend([""] * (col - len(row)))
+        row[col - 1] = str(value)
+
+    def append_row(self, values: List[Any]):
+        self._enter("append_row")
+        self.rows.append([str(v) for v in values])
+
+    def update_cell(self, row_index: int, col: int, value: Any):
+        self._enter("update_cell")
+        self._set(row_index, col, value)
+
+    def batch_update(self, data: List[Dict[str, Any]], raw: bool = False):
+        self._enter("batch_update")
+        for item in data:
+            row_index, col = a1_to_rowcol(item["range"])
+            self._set(row_index, col, item["values"][0][0])
+
+
+class FakeResponse:
+    def __init__(self, url: str, status_code: int, payload: Any = None, headers: Optional[Dict[str, str]] = None):
+        self.url = url
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.request = None
+
+    def json(self):
+        return self._payload
+
+    @property
+    def content(self) -> bytes:
+        return json.dumps(self._payload).encode()
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class FakeTrelloBoard:
+    # Lists, cards and card actions of one board. Ids grow monotonically like Trello's ObjectIds,
+    # so "before=<id>" paging and newest-first ordering behave as on the real API.
+    def __init__(self, board_id: str = "board", list_names=("TODO", "INPROGRESS", "DONE")):
+        self.board_id = board_id
+        self.seq = 0
+        self.clock = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.lists: Dict[str, str] = {}
+        self.cards: Dict[str, Dict[str, Any]] = {}
+        self.actions: List[Dict[str, Any]] = []
+        for name in list_names:
+            self.add_list(name)
+
+    def next_id(self) -> str:
+        self.seq += 1
+        return f"{self.seq:024x}"
+
+    def now(self) -> str:
+        self.clock += timedelta(milliseconds=1)
+        return self.clock.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+    def add_list(self, name: str) -> Dict[str, str]:
+        list_id = self.next_id()
+        self.lists[list_id] = name
+        return {"id": list_id, "name": name}
+
+    def list_id(self, name: str) -> str:
+        return next(i for i, n in self.lists.items() if n.lower() == name.lower())
+
+    def add_card(self, name: str, id_list: str, desc: str = "", record: bool = True) -> Dict[str, Any]:
+        card = {"id": self.next_id(), "name": name, "desc": desc, "idList": id_list, "closed": False,
+                "dateLastActivity": self.now()}
+        self.cards[card["id"]] = card
+        if record:
+            self._action("createCard", card)
+        return card
+
+    def update_card(self, card_id: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+        card = self.cards[card_id]
+        for key, value in changes.items():
+            if key == "closed":
+                value = str(value).lower() == "true"
+            card[key] = value
+        card["dateLastActivity"] = self.now()
+        self._action("updateCard", card)
+        return card
+
+    def _action(self, kind: str, card: Dict[str, Any]):
+        self.actions.append({"id": self.next_id(), "type": kind, "date": card["dateLastActivity"],
+                             "data": {"card": {"id": card["id"], "name": card["name"]}}})
+
+
+def _project(card: Dict[str, Any], fields: Optional[str]) -> Dict[str, Any]:
+    if not fields or fields == "all":
+        return dict(card)
+    wanted = set(fields.split(",")) | {"id"}
+    return {k: v for k, v in card.items() if k in wanted}
+
+
+class FakeTrelloSession:
+    # Stands in for requests.Session in TrelloClient: routes the REST calls the client makes to a
+    # FakeTrelloBoard.
+    def __init__(self, board: FakeTrelloBoard, faults: Optional[Faults] = None):
+        self.board = board
+        self.faults = faults or Faults()
+        self.hooks: Dict[str, list] = {"response": []}
+        self.lock = threading.Lock()
+
+    def request(self, method, url, params=None, data=None, timeout=None):
+        path = "/" + url.split("/1/", 1)[1] if "/1/" in url else url
+        status = self.faults.enter(f"{method} {endpoint_label(path)}")
+        if status is not None:
+            headers = {"Retry-After": "0"} if status == 429 else {}
+            return FakeResponse(url, status, {"error": "injected"}, headers)
+        with self.lock:
+            return self._route(method, url, path.split("/")[1:], dict(params or {}), dict(data or {}))
+
+    def _route(self, method, url, parts, params, data):
+        board = self.board
+        if parts[0] == "boards" and method == "GET":
+            if parts[2] == "lists":
+                return FakeResponse(url, 200, [{"id": i, "name": n} for i, n in board.lists.items()])
+            if parts[2] == "cards":
+                cards = sorted((c for c in board.cards.values() if not c["closed"]),
+                               key=lambda c: c["id"], reverse=True)
+                if params.get("before"):
+                    cards = [c for c in cards if c["id"] < params["before"]]
+                if params.get("limit"):
+                    cards = cards[:int(params["limit"])]
+                return FakeResponse(url, 200, [_project(c, params.get("fields")) for c in cards])
+            if parts[2] == "actions":
+                actions = list(reversed(board.actions))
+                if params.get("since"):
+                    actions = [a for a in actions if a["date"] > params["since"]]
+                if params.get("before"):
+                    actions = [a for a in actions if a["id"] < params["before"]]
+                return FakeResponse(url, 200, actions[:int(params.get("limit", 50))])
+        if parts[0] == "cards":
+            if method == "POST":
+                card = board.add_card(data.get("name", ""), data.get("idList"), data.get("desc", ""))
+                return FakeResponse(url, 200, dict(card))
+            card = board.cards.get(parts[1])
+            if card is None:
+                return FakeResponse(url, 404, "The requested resource was not found.")
+            if method == "GET":
+                return FakeResponse(url, 200, _project(card, params.get("fields")))
+            if method == "PUT":
+                changes = {k: v for k, v in data.items() if k not in ("key", "token")}
+                return FakeResponse(url, 200, dict(board.update_card(card["id"], changes)))
+        if parts[0] == "lists" and method == "POST":
+            return FakeResponse(url, 200, board.add_list(data.get("name", "")))
+        if parts[0] == "webhooks" and method == "POST":
+            return FakeResponse(url, 200, {"id": board.next_id(), "callbackURL": data.get("callbackURL")})
+        return FakeResponse(url, 404, "not found")
+
+
+def fake_sheet_client(ws: FakeWorksheet) -> GoogleSheetClient:
+    return GoogleSheetClient(ws=ws)
+
+
+def fake_trello_client(board: FakeTrelloBoard, faults: Optional[Faults] = None) -> TrelloClient:
+    # No client-side rate limit and near-zero backoff so injected 429s/5xx exercise the retry path
+    # without stretching the benchmark.
+    return TrelloClient("fake", "fake", board.board_id, session=FakeTrelloSession(board, faults),
+                        limiter=TokenBucket(rate=0), retry=RetryPolicy(backoff_base=0.001, backoff_max=0.01))
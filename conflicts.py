@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger("sync")
+
+# What happens when a lead changed on both sides since the last sync and the values disagree:
+#   sheet-wins   the sheet value is pushed to the card;
+#   newest-wins  the side edited last wins, by the card's dateLastActivity vs the row's updated-at
+#                column (SHEET_UPDATED_AT_COLUMN) or, without one, the spreadsheet's Drive modifiedTime;
+#   field-owner  each field has an owning side (CONFLICT_FIELD_OWNERS), "sheet" for unlisted fields.
+# Any policy other than sheet-wins reads the card (one GET) before pushing a sheet edit to it.
+SHEET_WINS = "sheet-wins"
+NEWEST_WINS = "newest-wins"
+FIELD_OWNER = "field-owner"
+POLICIES = (SHEET_WINS, NEWEST_WINS, FIELD_OWNER)
+
+CONFLICT_POLICY = os.getenv("CONFLICT_POLICY", SHEET_WINS).strip().lower()
+# e.g. "category=trello,note=trello"
+CONFLICT_FIELD_OWNERS = os.getenv("CONFLICT_FIELD_OWNERS", "")
+SHEET_UPDATED_AT_COLUMN = os.getenv("SHEET_UPDATED_AT_COLUMN", "updated_at").strip().lower()
+
+SHEET = "sheet"
+TRELLO = "trello"
+
+
+def parse_owners(spec: str) -> Dict[str, str]:
+    owners = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        field, sep, side = item.partition("=")
+        side = side.strip().lower()
+        if not sep or side not in (SHEET, TRELLO):
+            raise ValueError(f"Bad CONFLICT_FIELD_OWNERS entry {item!r}; expected <field>=sheet|trello")
+        owners[field.strip().lower()] = side
+    return owners
+
+
+def parse_time(value: Any) -> Optional[float]:
+    # Epoch seconds from an ISO 8601 string (Trello's "2024-01-01T10:00:00.000Z", Drive's modifiedTime,
+    # "2024-01-01 10:00:00" typed in a sheet) or a number of epoch seconds. Naive times are taken as UTC.
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class ConflictResolver:
+    def __init__(self, policy: str = CONFLICT_POLICY, owners: Optional[Dict[str, str]] = None,
+                 sheet_time_source: Optional[Callable[[], Any]] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown CONFLICT_POLICY {policy!r}; expected one of {', '.join(POLICIES)}")
+        self.policy = policy
+        self.owners = parse_owners(CONFLICT_FIELD_OWNERS) if owners is None else owners
+        # Fallback sheet edit time for rows without an updated-at cell (e.g. GoogleSheetClient.modified_time).
+        # Fetched at most once per pass; see start_pass.
+        self.sheet_time_source = sheet_time_source
+        self._sheet_time: Any = None
+        self._sheet_time_loaded = False
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy != SHEET_WINS
+
+    def start_pass(self):
+        with self.lock:
+            self._sheet_time_loaded = False
+            self._sheet_time = None
+
+    def fallback_sheet_time(self) -> Optional[float]:
+        with self.lock:
+            if not self._sheet_time_loaded and self.sheet_time_source is not None:
+                try:
+                    self._sheet_time = parse_time(self.sheet_time_source())
+                except Exception as e:
+                    logger.warning("Could not read the sheet's modified time: %s", e)
+                self._sheet_time_loaded = True
+            return self._sheet_time
+
+    def winner(self, field: str, sheet_time: Optional[float], card_time: Optional[float]) -> str:
+        if self.policy == FIELD_OWNER:
+            return self.owners.get(field, SHEET)
+        if self.policy == NEWEST_WINS and sheet_time is not None and card_time is not None:
+            return TRELLO if card_time > sheet_time else SHEET
+        return SHEET
+
+    def resolve(self, sid: str, sheet_changes: Dict[str, str], card_changes: Dict[str, str],
+                sheet_time: Optional[float], card_time: Optional[float]) -> Tuple[Dict[str, str], Dict[str, str]]:
+        # Splits the sheet's changes into (changes to push to the card, fields where the card keeps its
+        # value). Fields changed on one side only, or to the same value on both, are not conflicts.
+        push = dict(sheet_changes)
+        kept = {}
+        for field, card_value in card_changes.items():
+            if field not in push or push[field] == card_value:
+                continue
+            side = self.winner(field, sheet_time, card_time)
+            metrics.inc("conflicts_total", field=field, winner=side)
+            logger.info("Conflict on %s for sid %s: sheet=%r trello=%r -> %s wins (%s)", field, sid, push[field],
+                        card_value, side, self.policy)
+            if side == TRELLO:
+                push.pop(field)
+                kept[field] = card_value
+        return push, kept
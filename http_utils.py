@@ -0,0 +1,95 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Methods that are safe to resend after a 5xx or a dropped connection.
+IDEMPOTENT_METHODS = {"GET", "PUT", "DELETE", "HEAD", "OPTIONS"}
+
+
+def make_session(pool_size: int = 10) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class TokenBucket:
+    # Trello allows 100 requests per 10 seconds per token; 9/s with a burst of 10 stays under that
+    # for any 10 second window.
+    def __init__(self, rate: float = 9.0, capacity: float = 10.0):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        # Blocks until `tokens` are available; returns the time spent waiting.
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def drain(self):
+        # Called after a 429 so callers back off together instead of hammering the API.
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = 0.0
+
+
+class RetryPolicy:
+    def __init__(self, max_retries: int = 5, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 retry_statuses=(429, 500, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = set(retry_statuses)
+
+    def should_retry(self, attempt: int, method: str, status: Optional[int] = None) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if status is None:
+            # Connection error or timeout: the request may have been applied, so only resend idempotent ones.
+            return method.upper() in IDEMPOTENT_METHODS
+        if status == 429:
+            return True
+        return status in self.retry_statuses and method.upper() in IDEMPOTENT_METHODS
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        server_delay = parse_retry_after(retry_after)
+        if server_delay is not None:
+            return min(server_delay, self.backoff_max)
+        # Exponential backoff with full jitter.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -1,22 +1,155 @@
 import os
-from typing import List, Dict, Optional, Any
-import gspread
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Any, Tuple, Iterator
 from dotenv import load_dotenv
 
+from metrics import metrics
+
 load_dotenv()
 
+logger = logging.getLogger("sync")
+
 CREDENTIALS_FILE = os.getenv("CREDENTIALS_FILE")
 SHEET_ID = os.getenv("SHEET_ID")
 
+# Ranges per values_batch_update request when flushing buffered writes; 0 sends them all in one request.
+BATCH_CHUNK_SIZE = int(os.getenv("SHEET_BATCH_CHUNK_SIZE", "500"))
+
+# Rows per ws.get() request when streaming the sheet; 0 reads it in one get_all_records call.
+READ_CHUNK_SIZE = int(os.getenv("SHEET_READ_CHUNK_SIZE", "0"))
+
+
+def rowcol_to_a1(row: int, col: int) -> str:
+    # Same as gspread.utils.rowcol_to_a1; importing gspread.utils loads all of gspread and google-auth,
+    # which this module only does once a real client is opened.
+    label = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        label = chr(65 + rem) + label
+    return f"{label}{row}"
+
+
+def _numericise_all(values: List[Any]) -> List[Any]:
+    from gspread.utils import numericise_all
+
+    return numericise_all(values, empty2zero=False)
+
+
+def _timed(call):
+    return metrics.timed("client_call_seconds", client="sheet", call=call)
+
+
+def _timed_iter(call):
+    return metrics.timed_iter("client_call_seconds", client="sheet", call=call)
+
+
+class SheetRow:
+    # One data row from iter_rows: the raw cell list plus a header->index map shared by every row,
+    # instead of a dict per row. Supports the row.get(...) lookups the sync uses.
+    __slots__ = ("values", "cols")
+
+    def __init__(self, values: List[Any], cols: Dict[str, int]):
+        self.values = values
+        self.cols = cols
+
+    def get(self, key: str, default: Any = None) -> Any:
+        idx = self.cols.get(key)
+        if idx is None:
+            return default
+        # get_all_records pads short rows with "", so do the same.
+        return self.values[idx] if idx < len(self.values) else ""
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.cols:
+            raise KeyError(key)
+        return self.get(key)
+
+    def items(self):
+        return [(k, self.get(k)) for k in self.cols]
+
+
 class GoogleSheetClient:
-    def __init__(self, credentials_file: str = CREDENTIALS_FILE, sheet_id: str = SHEET_ID):
-        if not credentials_file or not sheet_id:
+    def __init__(self, credentials_file: str = CREDENTIALS_FILE, sheet_id: str = SHEET_ID,
+                 worksheet: Any = 0, ws: Any = None, cache: Optional[Dict[str, Any]] = None):
+        # ws: an already opened worksheet (or a stand-in with the same methods, e.g. the benchmark
+        # fakes); skips authentication. Otherwise gspread is imported and the worksheet opened on
+        # first use, so constructing a client costs no imports or API calls.
+        # cache: a dict the caller persists between runs (see main.py --once). The Google access token
+        # and the worksheet's properties are kept there, saving the token exchange and the spreadsheet
+        # metadata read on the next start.
+        if ws is None and (not credentials_file or not sheet_id):
             raise RuntimeError("Please set CREDENTIALS_FILE and SHEET_ID in env")
-        self.gc = gspread.service_account(filename=credentials_file)
-        self.sheet = self.gc.open_by_key(sheet_id)
-        self.ws = self.sheet.get_worksheet(0)
+        self.credentials_file = credentials_file
+        self.sheet_id = sheet_id
+        self.worksheet = worksheet
+        self.cache = cache if cache is not None else {}
+        self.gc = None
+        self.sheet = None
+        self._ws = ws
+
+        # header name (stripped, lowercased) -> 1-based column, and sheet id -> 1-based row.
+        # Built from the read_rows pass so updates don't re-download header/id column.
+        self.header_cols: Dict[str, int] = {}
+        self.row_index_by_id: Dict[str, int] = {}
+        self._last_row_index = 1
+        self._rescanned = False
 
+        # Buffered cell writes: (key, row, col, value). key is usually the lead's sheet id.
+        self._pending_updates: List[Tuple[Any, int, int, Any]] = []
+        # Keys passed explicitly to queue_*: sheet ids whose rows are checked before the flush.
+        self._pending_ids: set = set()
+
+    @property
+    def ws(self):
+        if self._ws is None:
+            self._open()
+        return self._ws
+
+    def _open(self):
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        creds = Credentials.from_service_account_file(self.credentials_file, scopes=gspread.auth.DEFAULT_SCOPES)
+        token = self.cache.get("token")
+        if token:
+            # google-auth keeps expiry as naive UTC.
+            expiry = datetime.fromisoformat(token["expiry"])
+            if expiry - timedelta(minutes=5) > datetime.now(timezone.utc).replace(tzinfo=None):
+                creds.token = token["access_token"]
+                creds.expiry = expiry
+                logger.info("Reusing cached Google access token (expires %s UTC)", token["expiry"])
+        self.gc = gspread.Client(auth=creds)
+        metrics.instrument_session(self.gc.http_client.session, "sheets")
+
+        key = [self.sheet_id, self.worksheet]
+        cached = self.cache.get("worksheet")
+        # Chunked reads rely on the row count, which the cached properties may have outgrown.
+        if cached and cached.get("key") == key and READ_CHUNK_SIZE <= 0:
+            self._ws = gspread.Worksheet(None, cached["properties"], self.sheet_id, self.gc.http_client)
+            return
+        self.sheet = self.gc.open_by_key(self.sheet_id)
+        # worksheet is a 0-based index or a tab title.
+        if isinstance(self.worksheet, str):
+            self._ws = self.sheet.worksheet(self.worksheet)
+        else:
+            self._ws = self.sheet.get_worksheet(self.worksheet)
+        if self._ws is None:
+            raise RuntimeError(f"Worksheet {self.worksheet!r} not found in sheet {self.sheet_id}")
+        self.cache["worksheet"] = {"key": key, "properties": dict(self._ws._properties)}
+
+    def save_token(self):
+        # Stores the current access token in the cache (it may have been refreshed during the run).
+        # gspread 6 keeps the credentials on the client's HTTPClient.
+        creds = getattr(self.gc.http_client, "auth", None) if self.gc is not None else None
+        if creds is not None and getattr(creds, "token", None) and getattr(creds, "expiry", None):
+            self.cache["token"] = {"access_token": creds.token, "expiry": creds.expiry.isoformat()}
+
+    @_timed("read_rows")
     def read_rows(self) -> List[Dict[str, Any]]:
+        return self._read_rows()
+
+    def _read_rows(self) -> List[Dict[str, Any]]:
         records = self.ws.get_all_records(empty2zero=False)
         normalized = []
         for r in records:
@@ -24,81 +157,315 @@ class GoogleSheetClient:
             for k, v in r.items():
                 norm[k.strip().lower()] = v
             normalized.append(norm)
+        self._rebuild_index(list(records[0].keys()) if records else None, normalized)
         return normalized
 
-    def append_row(self, row: List[Any]):
-        self.ws.append_row([str(x) for x in row])
+    @_timed_iter("read_rows")
+    def iter_rows(self, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+        # Streams data rows in ranges of chunk_size rows (A2:F1001, A1002:F2001, ...) so memory stays
+        # bounded on very large sheets. Rebuilds the header and id->row maps as it goes. Timed as
+        # read_rows, without the time the caller spends on each row.
+        if chunk_size <= 0:
+            yield from self._read_rows()
+            return
 
-    def find_row_index_by_id(self, sheet_id_value: str) -> Optional[int]:
-        
-        header = self.ws.row_values(1)
-        id_col = None
-        for idx, h in enumerate(header, start=1):
-            if str(h).strip().lower() == "id":
-                id_col = idx
+        header_cols = self._header_map(self.ws.row_values(1))
+        if not header_cols:
+            return
+        last_col = max(header_cols.values())
+        # Same keys as get_all_records: stripped, lowercased header -> 0-based cell index.
+        cols = {name: col - 1 for name, col in header_cols.items()}
+        id_idx = cols.get("id")
+
+        row_index_by_id: Dict[str, int] = {}
+        self.header_cols = header_cols
+        self.row_index_by_id = row_index_by_id
+        self._rescanned = False
+        start = 2
+        last_row = 1
+        while True:
+            end = start + chunk_size - 1
+            values = self.ws.get(f"{rowcol_to_a1(start, 1)}:{rowcol_to_a1(end, last_col)}")
+            for offset, cells in enumerate(values):
+                row_idx = start + offset
+                cells = _numericise_all(list(cells))
+                if id_idx is not None and id_idx < len(cells) and str(cells[id_idx]).strip() != "":
+                    row_index_by_id.setdefault(str(cells[id_idx]).strip(), row_idx)
+                last_row = row_idx
+                self._last_row_index = last_row
+                yield SheetRow(cells, cols)
+            # A short chunk means the data ended, unless the grid is known to go further.
+            if len(values) < chunk_size and end >= self.ws.row_count:
                 break
+            start = end + 1
+
+    @_timed("read_rows_by_ids")
+    def read_rows_by_ids(self, ids: List[str]) -> List[Dict[str, Any]]:
+        # Fetches only the given leads' rows (one batch_get) using the cached id->row index.
+        # Rows are checked against the requested id, and the index is reloaded once if rows moved.
+        wanted = [str(i).strip() for i in ids if str(i).strip() != ""]
+        if not wanted:
+            return []
+        if not self.header_cols:
+            self._load_index()
+        rows = self._fetch_rows(wanted)
+        if len(rows) < len(wanted):
+            self._load_index()
+            rows = self._fetch_rows(wanted)
+        return rows
+
+    def _fetch_rows(self, ids: List[str]) -> List[Dict[str, Any]]:
+        indexed = [(sid, self.row_index_by_id[sid]) for sid in ids if sid in self.row_index_by_id]
+        if not indexed or "id" not in self.header_cols:
+            return []
+        last_col = max(self.header_cols.values())
+        ranges = [f"{rowcol_to_a1(r, 1)}:{rowcol_to_a1(r, last_col)}" for _, r in indexed]
+        results = self.ws.batch_get(ranges)
+        rows = []
+        for (sid, _), values in zip(indexed, results):
+            cells = _numericise_all(list(values[0]) if values else [])
+            cells += [""] * (last_col - len(cells))
+            row = {name: cells[col - 1] for name, col in self.header_cols.items()}
+            if str(row.get("id", "")).strip() == sid:
+                rows.append(row)
+        return rows
+
+    def verified_row_indexes(self, ids: List[str]) -> Dict[str, int]:
+        # Current rows of the given leads: cached rows are checked against their id cells in one
+        # batch_get, and the index is reloaded if any row moved (rows inserted or deleted above it)
+        # or an id is not indexed yet. Leads with no row are left out.
+        wanted = [str(i).strip() for i in ids if str(i).strip() != ""]
+        if not wanted:
+            return {}
+        fresh = not self.header_cols
+        if fresh:
+            self._load_index()
+        id_col = self.header_cols.get("id")
         if id_col is None:
-            return None
+            return {}
+        cached = [(sid, self.row_index_by_id[sid]) for sid in wanted if sid in self.row_index_by_id]
+        rows = {}
+        if cached and not fresh:
+            results = self.ws.batch_get([rowcol_to_a1(r, id_col) for _, r in cached])
+            for (sid, row_idx), values in zip(cached, results):
+                cell = _numericise_all([values[0][0]])[0] if values and values[0] else ""
+                if str(cell).strip() == sid:
+                    rows[sid] = row_idx
+        elif fresh:
+            rows = dict(cached)
+        if len(rows) < len(wanted) and not fresh:
+            self._load_index()
+            for sid in wanted:
+                if sid not in rows and sid in self.row_index_by_id:
+                    rows[sid] = self.row_index_by_id[sid]
+        return rows
+
+    def invalidate_index(self):
+        # Drops the maps so the next lookup reloads them; verified_row_indexes and flush_updates
+        # already notice moved rows on their own.
+        self.header_cols = {}
+        self.row_index_by_id = {}
+        self._last_row_index = 1
+        self._rescanned = False
+
+    def _rebuild_index(self, header: Optional[List[str]], rows: List[Dict[str, Any]]):
+        if header is None:
+            header = self.ws.row_values(1)
+        header_cols = self._header_map(header)
+
+        row_index_by_id = {}
+        # get_all_records keeps blank rows, so record i always sits on sheet row i + 2.
+        for row_idx, r in enumerate(rows, start=2):
+            sid = r.get("id")
+            if sid is None or str(sid).strip() == "":
+                continue
+            row_index_by_id.setdefault(str(sid).strip(), row_idx)
 
+        self.header_cols = header_cols
+        self.row_index_by_id = row_index_by_id
+        self._last_row_index = len(rows) + 1
+        self._rescanned = False
+
+    @staticmethod
+    def _header_map(header: List[Any]) -> Dict[str, int]:
+        header_cols = {}
+        for idx, h in enumerate(header, start=1):
+            key = str(h).strip().lower()
+            if key and key not in header_cols:
+                header_cols[key] = idx
+        return header_cols
+
+    def _load_index(self):
+        self.header_cols = self._header_map(self.ws.row_values(1))
+        self.row_index_by_id = {}
+        id_col = self.header_cols.get("id")
+        if id_col is None:
+            self._last_row_index = 1
+            return
         col_vals = self.ws.col_values(id_col)
         for row_idx, cell_val in enumerate(col_vals, start=1):
-            if row_idx == 1: 
+            if row_idx == 1:
                 continue
-            if cell_val is not None and str(cell_val).strip() == str(sheet_id_value).strip():
-                return row_idx
-        return None
+            if cell_val is not None and str(cell_val).strip() != "":
+                self.row_index_by_id.setdefault(str(cell_val).strip(), row_idx)
+        self._last_row_index = max(len(col_vals), 1)
 
-    def update_category_by_row_index(self, row_index: int, new_category: str):
-        header = self.ws.row_values(1)
-        col_index = None
-        for idx, h in enumerate(header, start=1):
-            if str(h).strip().lower() == "category":
-                col_index = idx
-                break
+    def _rescan_once(self) -> bool:
+        # At most one extra header/id-column download between read_rows passes.
+        if self._rescanned:
+            return False
+        self._load_index()
+        self._rescanned = True
+        return True
+
+    def column_index(self, header_name: str) -> Optional[int]:
+        if not self.header_cols:
+            self._load_index()
+        return self.header_cols.get(header_name.strip().lower())
+
+    @_timed("append_row")
+    def append_row(self, row: List[Any]):
+        self.ws.append_row([str(x) for x in row])
+        if not self.header_cols:
+            return
+        self._last_row_index += 1
+        id_col = self.header_cols.get("id")
+        if id_col is not None and id_col <= len(row) and str(row[id_col - 1]).strip() != "":
+            self.row_index_by_id.setdefault(str(row[id_col - 1]).strip(), self._last_row_index)
+
+    def find_row_index_by_id(self, sheet_id_value: str) -> Optional[int]:
+        # Row from the cached index, which goes stale when rows are inserted or deleted. Fine for
+        # queue_*(key=<sheet id>), which flush_updates checks; use verified_row_indexes otherwise.
+        if not self.header_cols:
+            self._load_index()
+        if self.header_cols.get("id") is None:
+            return None
+
+        key = str(sheet_id_value).strip()
+        row_idx = self.row_index_by_id.get(key)
+        if row_idx is None and self._rescan_once():
+            # The id may have been added after the last read.
+            row_idx = self.row_index_by_id.get(key)
+        return row_idx
+
+    @_timed("update_field_by_row_index")
+    def _update_field_by_row_index(self, row_index: int, header_name: str, value: str):
+        col_index = self.column_index(header_name)
+        if col_index is None and self._rescan_once():
+            # Header may have been edited since the map was built.
+            col_index = self.header_cols.get(header_name)
         if col_index is None:
-            raise RuntimeError("Sheet has no 'category' header")
-        self.ws.update_cell(row_index, col_index, new_category)
+            raise RuntimeError(f"Sheet has no '{header_name}' header")
+        self.ws.update_cell(row_index, col_index, value)
+
+    def update_category_by_row_index(self, row_index: int, new_category: str):
+        self._update_field_by_row_index(row_index, "category", new_category)
 
     def update_name_by_row_index(self, row_index: int, new_name: str):
-        header = self.ws.row_values(1)
-        col_index = None
-        for idx, h in enumerate(header, start=1):
-            if str(h).strip().lower() == "name":
-                col_index = idx
-                break
-        if col_index is None:
-            raise RuntimeError("Sheet has no 'name' header")
-        self.ws.update_cell(row_index, col_index, new_name)
+        self._update_field_by_row_index(row_index, "name", new_name)
 
     def update_email_by_row_index(self, row_index: int, new_email: str):
-        header = self.ws.row_values(1)
-        col_index = None
-        for idx, h in enumerate(header, start=1):
-            if str(h).strip().lower() == "email":
-                col_index = idx
-                break
-        if col_index is None:
-            raise RuntimeError("Sheet has no 'email' header")
-        self.ws.update_cell(row_index, col_index, new_email)
+        self._update_field_by_row_index(row_index, "email", new_email)
 
     def update_note_by_row_index(self, row_index: int, new_note: str):
-        header = self.ws.row_values(1)
-        col_index = None
-        for idx, h in enumerate(header, start=1):
-            if str(h).strip().lower() == "note":
-                col_index = idx
-                break
-        if col_index is None:
-            raise RuntimeError("Sheet has no 'note' header")
-        self.ws.update_cell(row_index, col_index, new_note)
+        self._update_field_by_row_index(row_index, "note", new_note)
 
     def update_source_by_row_index(self, row_index: int, new_source: str):
-        header = self.ws.row_values(1)
-        col_index = None
-        for idx, h in enumerate(header, start=1):
-            if str(h).strip().lower() == "source":
-                col_index = idx
-                break
+        self._update_field_by_row_index(row_index, "source", new_source)
+
+    def _require_column(self, header_name: str) -> int:
+        col_index = self.column_index(header_name)
+        if col_index is None and self._rescan_once():
+            col_index = self.header_cols.get(header_name)
         if col_index is None:
-            raise RuntimeError("Sheet has no 'source' header")
-        self.ws.update_cell(row_index, col_index, new_source)
\ No newline at end of file
+            raise RuntimeError(f"Sheet has no '{header_name}' header")
+        return col_index
+
+    def queue_update_by_row_index(self, row_index: int, header_name: str, value: Any, key: Any = None):
+        # key: the lead's sheet id. The flush checks that row_index still holds it and follows the
+        # lead to its current row if not. Without a key the write goes to row_index as is.
+        col_index = self._require_column(header_name)
+        if key is not None:
+            self._pending_ids.add(key)
+        self._pending_updates.append((key if key is not None else row_index, row_index, col_index, value))
+
+    def queue_row_update(self, row_index: int, changes: Dict[str, Any], key: Any = None):
+        for header_name, value in changes.items():
+            self.queue_update_by_row_index(row_index, header_name, value, key=key)
+
+    @_timed("write_row_updates")
+    def write_row_updates(self, row_index: int, changes: Dict[str, Any]):
+        # One batch_update for one row, sent now; leaves the queue_* buffer alone (used by the outbox
+        # drainer thread).
+        items = [(None, row_index, self._require_column(name), value) for name, value in changes.items()]
+        if items:
+            self._send_batch(items)
+
+    @_timed("modified_time")
+    def modified_time(self) -> Optional[str]:
+        # Drive modifiedTime of the whole spreadsheet (any edit, ours included); None for a bare ws.
+        if self._ws is None:
+            self._open()
+        elif self.gc is None:
+            return None
+        return self.gc.get_file_drive_metadata(self.sheet_id)["modifiedTime"]
+
+    def pending_update_count(self) -> int:
+        return len(self._pending_updates)
+
+    # Sends buffered cell writes in chunked batch_update calls and returns {key: error} for failed keys.
+    @_timed("flush_updates")
+    def flush_updates(self, chunk_size: int = BATCH_CHUNK_SIZE) -> Dict[Any, Exception]:
+        pending = self._pending_updates
+        ids = self._pending_ids
+        self._pending_updates = []
+        self._pending_ids = set()
+        failures: Dict[Any, Exception] = {}
+        # A miss in the next pass may rescan the index again.
+        self._rescanned = False
+        if not pending:
+            return failures
+
+        # Rows may have been inserted or deleted since the index was built: move each lead's writes
+        # to the row that holds its id now (one batch_get, plus an id-column reload if any moved).
+        if ids:
+            try:
+                rows = self.verified_row_indexes([str(k) for k in ids])
+            except Exception as e:
+                return {key: e for key in {k for k, _, _, _ in pending}}
+            checked = []
+            for key, row, col, value in pending:
+                if key not in ids:
+                    checked.append((key, row, col, value))
+                elif str(key) in rows:
+                    checked.append((key, rows[str(key)], col, value))
+                else:
+                    failures[key] = RuntimeError(f"sheet row for id {key} not found")
+            pending = checked
+
+        if chunk_size <= 0:
+            chunk_size = len(pending) or 1
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            try:
+                self._send_batch(chunk)
+            except Exception as e:
+                metrics.inc("sheet_batch_failures_total")
+                if len({k for k, _, _, _ in chunk}) == 1:
+                    failures[chunk[0][0]] = e
+                    continue
+                # A batch is all-or-nothing; resend per key so one bad range doesn't sink the rest.
+                by_key: Dict[Any, List[Tuple[Any, int, int, Any]]] = {}
+                for item in chunk:
+                    by_key.setdefault(item[0], []).append(item)
+                for key, items in by_key.items():
+                    try:
+                        self._send_batch(items)
+                    except Exception as key_err:
+                        failures[key] = key_err
+        return failures
+
+    @_timed("send_batch")
+    def _send_batch(self, items: List[Tuple[Any, int, int, Any]]):
+        data = [{"range": rowcol_to_a1(row, col), "values": [[value]]} for _, row, col, value in items]
+        self.ws.batch_update(data, raw=False)
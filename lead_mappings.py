@@ -0,0 +1,195 @@
+import sys
+from typing import Any, Dict, Iterator, Optional, Set
+
+# sheet_hash/card_hash are fingerprints of the sheet row and of the card as last reconciled;
+# sheet_updated/card_activity are the row's updated-at cell and the card's dateLastActivity at that point.
+MAPPING_FIELDS = ("card_id", "category", "name", "email", "note", "source", "sheet_hash", "card_hash",
+                  "sheet_updated", "card_activity")
+
+
+class LeadMapping:
+    # Compact per-lead record: fixed slots instead of a dict per lead, with a dict-like interface
+    # (get/[]/update/pop/items) so sync code can keep treating it as one. Keys outside
+    # MAPPING_FIELDS go to `extra`, which stays None for most leads.
+    __slots__ = ("_owner", "_sid") + MAPPING_FIELDS + ("extra",)
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, owner=None, sid: Optional[str] = None):
+        self._owner = owner
+        self._sid = sid
+        for field in MAPPING_FIELDS:
+            setattr(self, field, None)
+        self.extra = None
+        for key, value in (data or {}).items():
+            self._set(key, value)
+
+    def _set(self, key, value):
+        if key in MAPPING_FIELDS:
+            if key == "category" and isinstance(value, str):
+                # Only a handful of categories exist; share one string object per value.
+                value = sys.intern(value)
+            if key == "card_id" and self._owner is not None:
+                self._owner._reindex(self._sid, getattr(self, key), value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def _touch(self):
+        if self._owner is not None:
+            self._owner.dirty.add(self._sid)
+
+    def get(self, key, default=None):
+        if key in MAPPING_FIELDS:
+            value = getattr(self, key)
+            return default if value is None else value
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._set(key, value)
+        self._touch()
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self._set(key, value)
+        self._touch()
+
+    def pop(self, key, *default):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        if key in MAPPING_FIELDS:
+            self._set(key, None)
+        else:
+            del self.extra[key]
+            if not self.extra:
+                self.extra = None
+        self._touch()
+        return value
+
+    def keys(self):
+        return [k for k, _ in self.items()]
+
+    def items(self):
+        out = [(f, getattr(self, f)) for f in MAPPING_FIELDS if getattr(self, f) is not None]
+        if self.extra:
+            out.extend(self.extra.items())
+        return out
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (LeadMapping, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"LeadMapping({self.to_dict()!r})"
+
+
+_MISSING = object()
+
+
+class MappingTable(dict):
+    # sid -> LeadMapping, plus a card_id -> sid index and the set of sids changed since the
+    # last save (so a state store can write just those).
+    def __init__(self, data=None):
+        super().__init__()
+        self.dirty: Set[str] = set()
+        self.sid_by_card_id: Dict[str, str] = {}
+        for sid, record in (data or {}).items():
+            super().__setitem__(sid, self._adopt(sid, record))
+
+    def _adopt(self, sid, record) -> LeadMapping:
+        data = record.to_dict() if isinstance(record, LeadMapping) else record
+        mapping = LeadMapping(None, self, sid)
+        for key, value in (data or {}).items():
+            mapping._set(key, value)
+        return mapping
+
+    def _reindex(self, sid, old_card_id, new_card_id):
+        if old_card_id and self.sid_by_card_id.get(old_card_id) == sid:
+            del self.sid_by_card_id[old_card_id]
+        if new_card_id:
+            self.sid_by_card_id[new_card_id] = sid
+
+    def sid_for_card(self, card_id: str) -> Optional[str]:
+        return self.sid_by_card_id.get(card_id)
+
+    def __setitem__(self, sid, record):
+        old = self.get(sid)
+        if old is not None:
+            self._reindex(sid, old.card_id, None)
+        super().__setitem__(sid, self._adopt(sid, record))
+        self.dirty.add(sid)
+
+    def __delitem__(self, sid):
+        self._reindex(sid, self[sid].card_id, None)
+        super().__delitem__(sid)
+        self.dirty.add(sid)
+
+    def pop(self, sid, *default):
+        if sid in self:
+            record = super().pop(sid)
+            self._reindex(sid, record.card_id, None)
+            self.dirty.add(sid)
+            return record
+        return super().pop(sid, *default)
+
+    def setdefault(self, sid, default=None):
+        if sid not in self:
+            self[sid] = default if default is not None else {}
+        return super().__getitem__(sid)
+
+    def update(self, *args, **kwargs):
+        for sid, record in dict(*args, **kwargs).items():
+            self[sid] = record
+
+    def clear(self):
+        self.dirty.update(self.keys())
+        self.sid_by_card_id.clear()
+        super().clear()
+
+    def take_dirty(self) -> Set[str]:
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {sid: record.to_dict() for sid, record in self.items()}
+
+
+def sid_for_card_id(mappings, card_id: str) -> Optional[str]:
+    if isinstance(mappings, MappingTable):
+        return mappings.sid_for_card(card_id)
+    for sid, mapped in mappings.items():
+        if mapped.get("card_id") == card_id:
+            return sid
+    return None
+
+
+def card_index(mappings) -> Dict[str, str]:
+    # card_id -> sid; the live index for a MappingTable, a one-off dict for plain mappings.
+    if isinstance(mappings, MappingTable):
+        return mappings.sid_by_card_id
+    return {m.get("card_id"): sid for sid, m in mappings.items() if m.get("card_id")}
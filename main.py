@@ -1,62 +1,351 @@
 import os
-import time
 import json
+import time
 import logging
+import argparse
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 from lead_client import GoogleSheetClient
 from task_client import TrelloClient
-from sync_logic import sync_sheet_to_trello, sync_trello_to_sheet
+from conflicts import ConflictResolver
+from sync_logic import sync_sheet_to_trello, sync_trello_to_sheet, ACTIONS_CURSOR_KEY
+from state_store import open_state_store
+from poll_scheduler import AdaptivePollScheduler
+from metrics import metrics, start_metrics_server, profile_cycle
+from http_utils import TokenBucket
 
 load_dotenv()
 
 
 DATA_JSON_PATH = os.getenv("DATA_JSON_PATH", "data.json")
 
+# State backend: "json" or "sqlite" (default: sqlite for .db/.sqlite paths). STATE_COMMIT is "lead"
+# (write after every changed lead) or "cycle" (one write per sync cycle).
+STATE_BACKEND = os.getenv("STATE_BACKEND") or None
+STATE_COMMIT = os.getenv("STATE_COMMIT", "lead")
+
+
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL") or "30")
+
+# Adaptive polling: the interval starts at POLL_INTERVAL, resets to it whenever a cycle changes
+# something and is multiplied by POLL_BACKOFF per idle cycle up to POLL_MAX_INTERVAL. It also backs
+# off while less than POLL_LOW_QUOTA of the Trello rate-limit window is left.
+# POLL_MAX_INTERVAL=POLL_INTERVAL keeps a fixed interval.
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL") or POLL_INTERVAL * 10)
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "2"))
+POLL_LOW_QUOTA = float(os.getenv("POLL_LOW_QUOTA", "0.2"))
+
+# Parallel Trello mutations in sheet -> Trello; 1 keeps the original one-at-a-time behaviour.
+SYNC_MAX_WORKERS = int(os.getenv("SYNC_MAX_WORKERS", "1"))
+
+# Webhook mode: local receiver address. FULL_SYNC_INTERVAL is how often webhook and delta modes
+# fall back to a full reconciliation pass.
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_CALLBACK_URL = os.getenv("TRELLO_WEBHOOK_CALLBACK_URL")
+TRELLO_API_SECRET = os.getenv("TRELLO_API_SECRET")
+SHEET_WEBHOOK_TOKEN = os.getenv("SHEET_WEBHOOK_TOKEN")
+FULL_SYNC_INTERVAL = int(os.getenv("FULL_SYNC_INTERVAL", "600"))
+
+# --backfill: concurrent card creates and how many new mappings go into each state checkpoint.
+BACKFILL_MAX_WORKERS = int(os.getenv("BACKFILL_MAX_WORKERS", "8"))
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "500"))
+
+# Outbox: OUTBOX_PATH (a SQLite file) queues card updates/archives and failed sheet writes, coalesced
+# per lead for OUTBOX_COALESCE_DELAY seconds and sent by a background thread; sheet writes from it
+# are limited to OUTBOX_SHEET_RATE per second. Unset sends everything inline, as before.
+OUTBOX_PATH = os.getenv("OUTBOX_PATH")
+OUTBOX_COALESCE_DELAY = float(os.getenv("OUTBOX_COALESCE_DELAY", "2"))
+OUTBOX_SHEET_RATE = float(os.getenv("OUTBOX_SHEET_RATE", "1"))
 
-POLL_INTERVAL = int(os.getenv("POLL_INTERVAL"))
+# Metrics: METRICS_PORT > 0 serves /metrics (Prometheus) and /stats (JSON); METRICS_JSON_PATH writes
+# the same stats to a file after every cycle. SYNC_PROFILE_DIR dumps a cProfile .prof per full cycle.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_JSON_PATH = os.getenv("METRICS_JSON_PATH")
+SYNC_PROFILE_DIR = os.getenv("SYNC_PROFILE_DIR")
+
+
+# --once keeps startup metadata (Google access token, worksheet properties, Trello list ids) in this
+# file so a short-lived run can skip the calls that fetch them. It holds a live bearer token, so it is
+# kept out of the state file and written readable by the owner only. The worksheet properties and
+# list ids are refetched every FULL_SYNC_INTERVAL, so a reordered tab or recreated list is picked up.
+STARTUP_CACHE_PATH = os.getenv("STARTUP_CACHE_PATH", ".startup_cache.json")
+# Where the cache used to live in the state file; dropped from older state files on load.
+STARTUP_CACHE_KEY = "startup_cache"
+# Key for when --once --delta last ran a full pass (FULL_SYNC_INTERVAL applies across runs).
+LAST_FULL_SYNC_KEY = "last_full_sync"
+REQUIRED_LISTS = ["TODO", "INPROGRESS", "DONE"]
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger("sync")
 
 
+_stores = {}
+
+
+def get_state_store(path):
+    if path not in _stores:
+        _stores[path] = open_state_store(path, STATE_BACKEND)
+    return _stores[path]
+
+
 def load_state(path):
+    return get_state_store(path).load()
+
+
+def save_state(path, state):
+    get_state_store(path).save(state)
+
+
+def load_startup_cache(path):
     try:
         with open(path, "r") as f:
-            return json.load(f)
+            cache = json.load(f)
     except FileNotFoundError:
-        return {"mappings": {}}
-    except json.JSONDecodeError:
-        return {"mappings": {}}
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable startup cache %s: %s", path, e)
+        return {}
+    return cache if isinstance(cache, dict) else {}
 
 
-def save_state(path, state):
-    with open(path, "w") as f:
-        json.dump(state, f, indent=2)
+def save_startup_cache(path, cache):
+    tmp = f"{path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    # Created 0600 rather than chmod-ed afterwards, so the token is never readable by others.
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
 
 
-def main():
-    sheet = GoogleSheetClient()
-    trello = TrelloClient()
-    trello.ensure_list_map(["TODO", "INPROGRESS", "DONE"])
+def clear_startup_cache(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
-    state = load_state(DATA_JSON_PATH)
-    mappings = state.setdefault("mappings", {}) 
 
-    logger.info("Starting two-way sync loop (title=name, desc=email/note/source). Poll interval %s seconds",
-                POLL_INTERVAL)
+@contextmanager
+def cycle_transaction(path):
+    # STATE_COMMIT=cycle writes state once per cycle instead of once per changed lead.
+    if STATE_COMMIT == "cycle":
+        with get_state_store(path).transaction():
+            yield
+    else:
+        yield
+
+
+def report_metrics():
+    if METRICS_JSON_PATH:
+        try:
+            metrics.write_json(METRICS_JSON_PATH)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", METRICS_JSON_PATH, e)
+
+
+def start_outbox(trello):
+    from outbox import Outbox, OutboxDrainer
+
+    outbox = Outbox(OUTBOX_PATH, coalesce_delay=OUTBOX_COALESCE_DELAY)
+    # The drainer thread gets its own sheet client: the sync's one buffers writes and caches row indexes.
+    drainer = OutboxDrainer(outbox, trello, GoogleSheetClient(),
+                            sheet_limiter=TokenBucket(OUTBOX_SHEET_RATE, max(1.0, OUTBOX_SHEET_RATE * 5)))
+    drainer.start()
+    logger.info("Outbox at %s: %d queued writes", OUTBOX_PATH, len(outbox))
+    return outbox
+
+
+def run_full_cycle(sheet, trello, mappings, state, use_actions=False, outbox=None, resolver=None):
+    # Returns the number of leads changed on either side.
+    metrics.inc("cycles_total", kind="full")
+    with profile_cycle(SYNC_PROFILE_DIR, f"cycle-{int(time.time() * 1000)}"), \
+            metrics.timer("cycle_seconds", kind="full"), cycle_transaction(DATA_JSON_PATH):
+        changes = sync_sheet_to_trello(sheet, trello, mappings, state, save_state, DATA_JSON_PATH,
+                                       max_workers=SYNC_MAX_WORKERS, outbox=outbox, resolver=resolver)
+        changes += sync_trello_to_sheet(sheet, trello, mappings, state, save_state, DATA_JSON_PATH,
+                                        use_actions=use_actions, outbox=outbox)
+    metrics.set("cycle_leads_changed", changes)
+    return changes
+
+
+def run_once(sheet, trello, mappings, state, cache, delta=False, resolver=None):
+    # One cycle for cron/serverless runs. cache is the startup cache loaded from STARTUP_CACHE_PATH (the
+    # sheet client holds its "sheet" entry). List ids come from it instead of ensure_list_map (the
+    # Trello -> sheet pass re-reads them anyway); it is saved again at the end.
+    if time.time() - cache.get("refreshed_at", 0) >= FULL_SYNC_INTERVAL:
+        # Cached ids that still resolve (a moved tab, a list recreated under the same name) never fail.
+        cache.get("sheet", {}).pop("worksheet", None)
+        cache.pop("trello_lists", None)
+        cache["refreshed_at"] = time.time()
+    lists = cache.get("trello_lists") or {}
+    if all(name.lower() in lists for name in REQUIRED_LISTS):
+        trello.lists = dict(lists)
+    else:
+        trello.ensure_list_map(REQUIRED_LISTS)
+
+    if delta and time.time() - state.get(LAST_FULL_SYNC_KEY, 0) >= FULL_SYNC_INTERVAL:
+        state.pop(ACTIONS_CURSOR_KEY, None)
+        state[LAST_FULL_SYNC_KEY] = time.time()
+    try:
+        changes = run_full_cycle(sheet, trello, mappings, state, use_actions=delta, resolver=resolver)
+    except Exception:
+        # Stale metadata (renamed tab, deleted list) would fail the next run the same way.
+        clear_startup_cache(STARTUP_CACHE_PATH)
+        save_state(DATA_JSON_PATH, state)
+        metrics.inc("cycle_errors_total")
+        report_metrics()
+        raise
+    cache["trello_lists"] = dict(trello.lists)
+    sheet.save_token()
+    save_state(DATA_JSON_PATH, state)
+    save_startup_cache(STARTUP_CACHE_PATH, cache)
+    report_metrics()
+    logger.info("Single sync cycle done: %d leads changed", changes)
+    return changes
+
+
+def run_poll_loop(sheet, trello, mappings, state, delta=False, outbox=None, resolver=None):
+    logger.info("Starting two-way sync loop (title=name, desc=email/note/source). Poll interval %s-%s seconds",
+                POLL_INTERVAL, POLL_MAX_INTERVAL)
     
+    scheduler = AdaptivePollScheduler(POLL_INTERVAL, POLL_MAX_INTERVAL, POLL_BACKOFF, POLL_LOW_QUOTA)
+    last_full = 0.0
+    while True:
+        started = time.monotonic()
+        changes = 0
+        try:
+            # Delta mode reads only the board actions since the stored cursor. Dropping the cursor
+            # makes the next pass a full one that starts a fresh cursor.
+            if delta and time.monotonic() - last_full >= FULL_SYNC_INTERVAL:
+                state.pop(ACTIONS_CURSOR_KEY, None)
+                last_full = time.monotonic()
+            changes = run_full_cycle(sheet, trello, mappings, state, use_actions=delta, outbox=outbox,
+                                     resolver=resolver)
+
+        except Exception as e:
+            metrics.inc("cycle_errors_total")
+            logger.exception("Error during sync loop: %s", e)
+
+        report_metrics()
+        time.sleep(scheduler.next_delay(changes, time.monotonic() - started, trello.quota_remaining))
+
+
+def run_webhook_loop(sheet, trello, mappings, state, outbox=None, resolver=None):
+    from webhook_server import ChangeQueue, WebhookReceiver
+
+    queue = ChangeQueue()
+    receiver = WebhookReceiver(queue, WEBHOOK_HOST, WEBHOOK_PORT, trello_secret=TRELLO_API_SECRET,
+                               trello_callback_url=WEBHOOK_CALLBACK_URL, sheet_token=SHEET_WEBHOOK_TOKEN)
+    receiver.start()
+    if WEBHOOK_CALLBACK_URL:
+        try:
+            trello.create_webhook(WEBHOOK_CALLBACK_URL)
+            logger.info("Registered Trello webhook -> %s", WEBHOOK_CALLBACK_URL)
+        except Exception as e:
+            # Trello answers 400 when the same callback is already registered for this board/token.
+            logger.warning("Could not register Trello webhook (may already exist): %s", e)
+
+    logger.info("Starting webhook-driven sync. Full reconciliation every %s seconds", FULL_SYNC_INTERVAL)
+    last_full = 0.0
     while True:
         try:
-            sync_sheet_to_trello(sheet, trello, mappings, state, save_state, DATA_JSON_PATH)
-            sync_trello_to_sheet(sheet, trello, mappings, state, save_state, DATA_JSON_PATH)
+            if time.monotonic() - last_full >= FULL_SYNC_INTERVAL:
+                # The full pass covers anything queued so far.
+                queue.drain()
+                run_full_cycle(sheet, trello, mappings, state, outbox=outbox, resolver=resolver)
+                last_full = time.monotonic()
+                report_metrics()
+                continue
 
+            changes = queue.drain(timeout=POLL_INTERVAL)
+            if not changes:
+                continue
+            metrics.inc("cycles_total", kind="webhook")
+            with metrics.timer("cycle_seconds", kind="webhook"), cycle_transaction(DATA_JSON_PATH):
+                if changes.sheet_dirty:
+                    sync_sheet_to_trello(sheet, trello, mappings, state, save_state, DATA_JSON_PATH,
+                                         max_workers=SYNC_MAX_WORKERS, outbox=outbox, resolver=resolver)
+                elif changes.sheet_ids:
+                    sync_sheet_to_trello(sheet, trello, mappings, state, save_state, DATA_JSON_PATH,
+                                         max_workers=SYNC_MAX_WORKERS, only_ids=changes.sheet_ids, outbox=outbox,
+                                         resolver=resolver)
+                if changes.card_ids:
+                    sync_trello_to_sheet(sheet, trello, mappings, state, save_state, DATA_JSON_PATH,
+                                         card_ids=changes.card_ids, outbox=outbox)
         except Exception as e:
+            metrics.inc("cycle_errors_total")
             logger.exception("Error during sync loop: %s", e)
+            time.sleep(POLL_INTERVAL)
+        report_metrics()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Two-way sync between the Lead Tracker sheet and Trello")
+    parser.add_argument("--webhook", action="store_true",
+                        help="process ids queued by the local webhook receiver instead of polling everything")
+    parser.add_argument("--delta", action="store_true",
+                        help="poll Trello board actions since the last cursor instead of downloading every card")
+    parser.add_argument("--backfill", action="store_true",
+                        help="one-off import: map rows to existing '(LeadID: N)' cards, create the rest, then exit")
+    parser.add_argument("--once", action="store_true",
+                        help="run a single sync cycle and exit (cron/serverless); reuses cached startup metadata")
+    parser.add_argument("--plan", nargs="?", const="-", metavar="PATH",
+                        help="dry run: print (or write to PATH) the next cycle's actions and API cost as JSON, then exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_HOST, METRICS_PORT)
+    state = load_state(DATA_JSON_PATH)
+    mappings = state.setdefault("mappings", {}) 
+    if state.pop(STARTUP_CACHE_KEY, None) is not None:
+        save_state(DATA_JSON_PATH, state)
+    # Clients connect on first use. Only --once reuses cached startup metadata: the long-running modes
+    # open the worksheet once per process anyway.
+    startup_cache = load_startup_cache(STARTUP_CACHE_PATH) if args.once else None
+    sheet = GoogleSheetClient(cache=startup_cache.setdefault("sheet", {}) if args.once else None)
+    trello = TrelloClient()
+    resolver = ConflictResolver(sheet_time_source=sheet.modified_time)
+
+    if args.plan is not None:
+        from planner import plan_cycle, write_plan
+
+        # Read-only: runs before ensure_list_map, which may create lists.
+        plan = plan_cycle(sheet, trello, mappings, resolver=resolver, max_workers=SYNC_MAX_WORKERS)
+        write_plan(plan, args.plan)
+        logger.info("Plan: %s; ~%d Trello and ~%d Sheets calls, ~%.0fs", plan["summary"],
+                    plan["api_calls"]["trello"]["total"], plan["api_calls"]["sheets"]["total"],
+                    plan["estimated_seconds"]["total"])
+        for warning in plan["warnings"]:
+            logger.warning("Plan: %s", warning)
+        return
+
+    if args.once:
+        run_once(sheet, trello, mappings, state, startup_cache, delta=args.delta, resolver=resolver)
+        return
+
+    trello.ensure_list_map(REQUIRED_LISTS)
+
+    if args.backfill:
+        from backfill import backfill_sheet_to_trello
+
+        backfill_sheet_to_trello(sheet, trello, mappings, state, save_state, DATA_JSON_PATH,
+                                 max_workers=BACKFILL_MAX_WORKERS, batch_size=BACKFILL_BATCH_SIZE)
+        return
 
-        time.sleep(POLL_INTERVAL)
+    outbox = start_outbox(trello) if OUTBOX_PATH else None
+    if args.webhook:
+        run_webhook_loop(sheet, trello, mappings, state, outbox=outbox, resolver=resolver)
+    else:
+        run_poll_loop(sheet, trello, mappings, state, delta=args.delta, outbox=outbox, resolver=resolver)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
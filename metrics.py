@@ -0,0 +1,262 @@
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("sync")
+
+# (name, ((label, value), ...)) -> value
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+# Path segments that are object ids (Trello 24-hex ids, spreadsheet/drive ids), so per-endpoint
+# labels don't grow one series per card.
+_ID_SEGMENT = re.compile(r"^(?:[0-9a-f]{24}|[A-Za-z0-9_-]{25,})$")
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def endpoint_label(url: str) -> str:
+    # https://api.trello.com/1/cards/<id>  -> /1/cards/{id}
+    # .../spreadsheets/<id>/values/Sheet1!A2:F1001  -> /v4/spreadsheets/{id}/values/{range}
+    path = urlsplit(url).path
+    head, sep, rng = path.partition("/values/")
+    if sep:
+        action = rng.rsplit(":", 1)[-1]
+        path = head + "/values/{range}" + (":" + action if action in ("append", "clear") else "")
+    return "/".join("{id}" if _ID_SEGMENT.match(seg) else seg for seg in path.split("/"))
+
+
+class Metrics:
+    # Counters, gauges and timers (count/sum/max seconds), each keyed by name and labels.
+    # Thread-safe; one process-wide instance lives in `metrics` below.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Key, float] = {}
+        self.gauges: Dict[Key, float] = {}
+        self.timers: Dict[Key, List[float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            t = self.timers.get(key)
+            if t is None:
+                self.timers[key] = [1, seconds, seconds]
+            else:
+                t[0] += 1
+                t[1] += seconds
+                t[2] = max(t[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _errors_name(name: str) -> str:
+        return (name[:-len("_seconds")] if name.endswith("_seconds") else name) + "_errors_total"
+
+    def timed(self, name: str, **labels):
+        # Decorator: times every call into `name` (seconds) and counts calls that raised in
+        # <name without _seconds>_errors_total.
+        errors = self._errors_name(name)
+
+        def wrap(fn):
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    self.inc(errors, **labels)
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return inner
+        return wrap
+
+    def timed_iter(self, name: str, **labels):
+        # Decorator for generators (streamed reads): like timed, but only the time spent producing
+        # items counts, not the caller's loop body. Recorded once, when the generator finishes or
+        # is closed.
+        errors = self._errors_name(name)
+
+        def wrap(fn):
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                it = fn(*args, **kwargs)
+                spent = 0.0
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(it)
+                        except StopIteration:
+                            return
+                        except Exception:
+                            self.inc(errors, **labels)
+                            raise
+                        finally:
+                            spent += time.perf_counter() - start
+                        yield item
+                finally:
+                    it.close()
+                    self.observe(name, spent, **labels)
+            return inner
+        return wrap
+
+    def instrument_session(self, session, service: str):
+        # Counts every HTTP response on a requests.Session: calls, status, latency and bytes.
+        if getattr(session, "_metrics_service", None):
+            return
+        session._metrics_service = service
+
+        def on_response(r, *args, **kwargs):
+            endpoint = endpoint_label(r.url)
+            method = r.request.method if r.request is not None else "GET"
+            self.inc("http_requests_total", service=service, method=method, endpoint=endpoint,
+                     status=r.status_code)
+            self.observe("http_request_seconds", r.elapsed.total_seconds(), service=service, method=method,
+                         endpoint=endpoint)
+            body = r.request.body if r.request is not None else None
+            if body:
+                self.inc("http_sent_bytes_total", len(body), service=service)
+            received = r.headers.get("Content-Length")
+            received = int(received) if received and received.isdigit() else len(r.content)
+            self.inc("http_received_bytes_total", received, service=service)
+        session.hooks.setdefault("response", []).append(on_response)
+
+    def take(self) -> Dict[str, list]:
+        # Returns everything recorded so far and starts over; used to ship a worker's numbers to the
+        # supervisor, which merge()s them.
+        with self.lock:
+            data = {
+                "counters": [[n, list(map(list, l)), v] for (n, l), v in self.counters.items()],
+                "gauges": [[n, list(map(list, l)), v] for (n, l), v in self.gauges.items()],
+                "timers": [[n, list(map(list, l)), list(v)] for (n, l), v in self.timers.items()],
+            }
+            self.counters, self.gauges, self.timers = {}, {}, {}
+        return data
+
+    def merge(self, data: Dict[str, list], **labels):
+        for name, lbls, value in data.get("counters", []):
+            self.inc(name, value, **dict(lbls, **labels))
+        for name, lbls, value in data.get("gauges", []):
+            self.set(name, value, **dict(lbls, **labels))
+        for name, lbls, (count, total, peak) in data.get("timers", []):
+            key = _key(name, dict(lbls, **labels))
+            with self.lock:
+                t = self.timers.setdefault(key, [0, 0.0, 0.0])
+                t[0] += count
+                t[1] += total
+                t[2] = max(t[2], peak)
+
+    def snapshot(self) -> Dict[str, list]:
+        with self.lock:
+            return {
+                "counters": [dict(name=n, labels=dict(l), value=v) for (n, l), v in sorted(self.counters.items())],
+                "gauges": [dict(name=n, labels=dict(l), value=v) for (n, l), v in sorted(self.gauges.items())],
+                "timers": [dict(name=n, labels=dict(l), count=v[0], sum=v[1], max=v[2])
+                           for (n, l), v in sorted(self.timers.items())],
+            }
+
+    def render_prometheus(self, prefix: str = "sync_") -> str:
+        def fmt(name, labels, value):
+            if labels:
+                inner = ",".join('%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+                return f"{prefix}{name}{{{inner}}} {value}"
+            return f"{prefix}{name} {value}"
+
+        lines = []
+        with self.lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({n for n, _ in series}):
+                    lines.append(f"# TYPE {prefix}{name} {kind}")
+                    lines.extend(fmt(name, l, v) for (n, l), v in sorted(series.items()) if n == name)
+            for name in sorted({n for n, _ in self.timers}):
+                items = [(l, v) for (n, l), v in sorted(self.timers.items()) if n == name]
+                lines.append(f"# TYPE {prefix}{name} summary")
+                for l, v in items:
+                    lines.append(fmt(name + "_count", l, v[0]))
+                    lines.append(fmt(name + "_sum", l, v[1]))
+                lines.append(f"# TYPE {prefix}{name}_max gauge")
+                lines.extend(fmt(name + "_max", l, v[2]) for l, v in items)
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+
+metrics = Metrics()
+
+
+def start_metrics_server(host: str, port: int, registry: Metrics = metrics):
+    # GET /metrics (Prometheus text format) and GET /stats (JSON) on a daemon thread. http.server is
+    # imported here so short runs without the endpoint don't pay for it.
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            logger.debug("metrics %s", fmt % args)
+
+        def do_GET(self):
+            if self.path.startswith("/metrics"):
+                body, ctype = registry.render_prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path.startswith("/stats"):
+                body, ctype = json.dumps(registry.snapshot()).encode(), "application/json"
+            else:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Metrics endpoint listening on %s:%s", *server.server_address[:2])
+    return server
+
+
+@contextmanager
+def profile_cycle(directory: Optional[str], name: str):
+    # With a directory set, profiles the block with cProfile and writes <directory>/<name>.prof
+    # (open with `python -m pstats` or snakeviz).
+    if not directory:
+        yield
+        return
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, f"{name}.prof"))
@@ -0,0 +1,247 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from http_utils import TokenBucket
+from metrics import metrics
+
+logger = logging.getLogger("sync")
+
+# Targets: "trello" ops patch or archive a card; "sheet" ops write cells of a lead's row.
+TRELLO = "trello"
+SHEET = "sheet"
+
+
+def op_key(target: str, sid: str, op: Dict[str, Any]) -> str:
+    # Trello ops are queued per card, sheet ops per lead. A lead re-created on Trello while the archive
+    # of its old card is still queued (e.g. in backoff) then has two entries, and the archive is sent.
+    if target == TRELLO and op.get("card_id"):
+        return op["card_id"]
+    return sid
+
+
+def merge_ops(target: str, old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    # Coalesces a newer op for the same queue key (card or row) into the queued one, so N edits send once.
+    if target == SHEET:
+        return {"changes": dict(old.get("changes") or {}, **(new.get("changes") or {}))}
+    if new.get("archive"):
+        # Archiving makes earlier edits moot.
+        return dict(new)
+    if old.get("archive"):
+        # Nothing to patch on a card that is about to be archived.
+        return dict(old)
+    merged = dict(old)
+    for key in ("name", "list"):
+        if new.get(key) is not None:
+            merged[key] = new[key]
+    if new.get("fields") is not None:
+        merged["fields"] = dict(old.get("fields") or {}, **new["fields"])
+    return merged
+
+
+class OutboxItem:
+    __slots__ = ("target", "key", "sid", "op", "seq", "attempts")
+
+    def __init__(self, target: str, key: str, sid: str, op: Dict[str, Any], seq: int, attempts: int):
+        self.target = target
+        self.key = key
+        self.sid = sid
+        self.op = op
+        self.seq = seq
+        self.attempts = attempts
+
+
+class Outbox:
+    # Durable queue of pending Trello/sheet writes in SQLite, one row per (target, key) where key is the
+    # card id for Trello ops and the lead's sheet id for sheet ops (see op_key). put() merges into the
+    # queued op; an item only leaves the queue once it was sent (done) or can never succeed (drop), so
+    # every change is delivered at least once, across restarts too.
+    def __init__(self, path: str, coalesce_delay: float = 2.0, backoff_base: float = 1.0, backoff_max: float = 300.0):
+        self.path = path
+        self.coalesce_delay = coalesce_delay
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+            if columns and "key" not in columns:
+                # Queues written when Trello ops were keyed by lead: re-key them by card.
+                self.conn.execute("ALTER TABLE outbox RENAME TO outbox_by_sid")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox (target TEXT, key TEXT, sid TEXT, op TEXT, seq INTEGER, "
+                "attempts INTEGER DEFAULT 0, next_at REAL, last_error TEXT, PRIMARY KEY (target, key))")
+            if columns and "key" not in columns:
+                rows = self.conn.execute("SELECT target, sid, op, seq, attempts, next_at, last_error "
+                                         "FROM outbox_by_sid").fetchall()
+                self.conn.executemany(
+                    "INSERT INTO outbox (target, key, sid, op, seq, attempts, next_at, last_error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(t, op_key(t, s, json.loads(op)), s, op, *rest) for t, s, op, *rest in rows])
+                self.conn.execute("DROP TABLE outbox_by_sid")
+        # In-memory copy of the queued entries: the sync checks for every lead whether it has any.
+        self._entries: Dict[Tuple[str, str], str] = {
+            (t, k): s for t, k, s in self.conn.execute("SELECT target, key, sid FROM outbox")}
+        self._pending = Counter((t, s) for (t, _), s in self._entries.items())
+        row = self.conn.execute("SELECT MAX(seq) FROM outbox").fetchone()
+        self._seq = row[0] or 0
+        metrics.set("outbox_pending", len(self._entries))
+
+    def has(self, target: str, sid: str) -> bool:
+        # Whether any write of this target is queued for the lead.
+        return self._pending[(target, sid)] > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, target: str, sid: str, op: Dict[str, Any]):
+        now = time.time()
+        key = op_key(target, sid, op)
+        with self.lock:
+            self._seq += 1
+            row = self.conn.execute("SELECT op FROM outbox WHERE target = ? AND key = ?", (target, key)).fetchone()
+            with self.conn:
+                if row:
+                    # Keep the scheduled time (and any backoff); only the payload changes.
+                    op = merge_ops(target, json.loads(row[0]), op)
+                    self.conn.execute("UPDATE outbox SET op = ?, seq = ? WHERE target = ? AND key = ?",
+                                      (json.dumps(op), self._seq, target, key))
+                    metrics.inc("outbox_coalesced_total", target=target)
+                else:
+                    self.conn.execute(
+                        "INSERT INTO outbox (target, key, sid, op, seq, next_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (target, key, sid, json.dumps(op), self._seq, now + self.coalesce_delay))
+            if (target, key) not in self._entries:
+                self._entries[(target, key)] = sid
+                self._pending[(target, sid)] += 1
+            metrics.set("outbox_pending", len(self._entries))
+
+    def due(self, limit: int = 100) -> List[OutboxItem]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT target, key, sid, op, seq, attempts FROM outbox WHERE next_at <= ? ORDER BY next_at LIMIT ?",
+                (time.time(), limit)).fetchall()
+        return [OutboxItem(t, k, s, json.loads(op), seq, attempts) for t, k, s, op, seq, attempts in rows]
+
+    def next_due_in(self) -> Optional[float]:
+        with self.lock:
+            row = self.conn.execute("SELECT MIN(next_at) FROM outbox").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def done(self, item: OutboxItem):
+        # Removes the item unless it was merged with a newer op while being sent; then the merged
+        # op goes out on the next round (the resend is harmless: ops carry full values).
+        with self.lock:
+            with self.conn:
+                cur = self.conn.execute("DELETE FROM outbox WHERE target = ? AND key = ? AND seq = ?",
+                                        (item.target, item.key, item.seq))
+            if cur.rowcount and self._entries.pop((item.target, item.key), None) is not None:
+                self._pending[(item.target, item.sid)] -= 1
+                if self._pending[(item.target, item.sid)] <= 0:
+                    del self._pending[(item.target, item.sid)]
+            metrics.set("outbox_pending", len(self._entries))
+
+    def drop(self, item: OutboxItem, error: Exception):
+        logger.error("Dropping queued %s write for sid %s after error: %s", item.target, item.sid, error)
+        metrics.inc("outbox_dropped_total", target=item.target)
+        self.done(item)
+
+    def retry_later(self, item: OutboxItem, error: Exception):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** item.attempts))
+        with self.lock:
+            with self.conn:
+                self.conn.execute("UPDATE outbox SET attempts = attempts + 1, next_at = ?, last_error = ? "
+                                  "WHERE target = ? AND key = ?",
+                                  (time.time() + delay, str(error), item.target, item.key))
+        metrics.inc("outbox_retries_total", target=item.target)
+        logger.warning("Queued %s write for sid %s failed (%s); retrying in %.0fs", item.target, item.sid, error,
+                       delay)
+
+    def close(self):
+        self.conn.close()
+
+
+class _Gone(Exception):
+    status = 404
+
+
+def _permanent(error: Exception) -> bool:
+    # 4xx other than 429 (card deleted, bad list, ...) won't succeed on retry.
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+class OutboxDrainer:
+    # Background thread that sends due outbox items. Trello calls go through the client's own rate
+    # limiter; sheet writes are paced by sheet_limiter (Sheets allows ~60 writes/min per user).
+    def __init__(self, outbox: Outbox, trello, sheet, sheet_limiter: Optional[TokenBucket] = None,
+                 idle_wait: float = 1.0):
+        self.outbox = outbox
+        self.trello = trello
+        self.sheet = sheet
+        self.sheet_limiter = sheet_limiter or TokenBucket(1.0, 5.0)
+        self.idle_wait = idle_wait
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="outbox-drainer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                sent = self.drain_once()
+            except Exception as e:
+                logger.exception("Outbox drainer error: %s", e)
+                sent = 0
+            if not sent:
+                wait = self.outbox.next_due_in()
+                self.stop_event.wait(self.idle_wait if wait is None else min(max(wait, 0.05), self.idle_wait))
+
+    def drain_once(self, limit: int = 100) -> int:
+        items = self.outbox.due(limit)
+        for item in items:
+            if self.stop_event.is_set():
+                break
+            try:
+                self.send(item)
+            except Exception as e:
+                if _permanent(e):
+                    self.outbox.drop(item, e)
+                else:
+                    self.outbox.retry_later(item, e)
+            else:
+                self.outbox.done(item)
+                metrics.inc("outbox_sent_total", target=item.target)
+        return len(items)
+
+    def send(self, item: OutboxItem):
+        op = item.op
+        if item.target == TRELLO:
+            if op.get("archive"):
+                self.trello.archive_card(op["card_id"])
+            else:
+                self.trello.apply_card_patch(op["card_id"], name=op.get("name"), list_name=op.get("list"),
+                                             fields=op.get("fields"))
+            return
+        self.sheet_limiter.acquire()
+        # This client never reads the whole sheet, so its index goes stale as rows are inserted or
+        # deleted: check the lead's row right before writing (reloads the index if it moved).
+        row_index = self.sheet.verified_row_indexes([item.sid]).get(item.sid)
+        if not row_index:
+            # Row deleted from the sheet; nothing left to write to.
+            raise _Gone(f"sheet row for id {item.sid} not found")
+        self.sheet.write_row_updates(row_index, op["changes"])
@@ -0,0 +1,178 @@
+import json
+import logging
+import math
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from lead_client import BATCH_CHUNK_SIZE, READ_CHUNK_SIZE
+from sync_diff import DESC_FIELDS
+from sync_logic import plan_sheet_row, plan_card_lead, iter_mapped_cards, LOCAL_ACTIONS, SHEET_TO_TRELLO
+from task_client import CARD_PAGE_SIZE
+
+logger = logging.getLogger("sync")
+
+# Rough round-trip times used for the time estimate; the rate limits usually dominate anyway.
+TRELLO_CALL_SECONDS = 0.3
+SHEETS_CALL_SECONDS = 0.5
+# Google Sheets API: 60 write requests per minute per user.
+SHEETS_WRITES_PER_MINUTE = 60
+# Trello: 100 requests per 10 seconds per token.
+TRELLO_TOKEN_LIMIT = 100
+TRELLO_TOKEN_WINDOW = 10.0
+
+
+def _label(action: Dict[str, Any]) -> str:
+    # create / recreate / archive as planned; a patch is a "move" when it changes the list.
+    if action["kind"] == "patch":
+        return "move" if "category" in action["changes"] else "update"
+    return action["kind"]
+
+
+def _sheet_entry(action: Dict[str, Any]) -> Dict[str, Any]:
+    entry = {"action": _label(action), "sid": action["sid"]}
+    if action.get("card_id"):
+        entry["card_id"] = action["card_id"]
+    if action["kind"] in ("create", "recreate"):
+        entry["list"] = action["list"]
+        entry["fields"] = {k: v for k, v in action["lead"].items() if k != "id"}
+    else:
+        entry["changes"] = action["changes"]
+        if action["kind"] == "patch" and "category" in action["changes"]:
+            entry["list"] = action["list"]
+    return entry
+
+
+def _bucket_seconds(calls: int, rate: float, burst: float) -> float:
+    # Time a token bucket needs to let `calls` through, starting full.
+    if rate <= 0:
+        return 0.0
+    return max(0.0, calls - burst) / rate
+
+
+def plan_cycle(sheet, trello, mappings, resolver=None, max_workers: int = 1) -> Dict[str, Any]:
+    # What one full cycle (sheet -> Trello, then Trello -> sheet) would do, without sending anything:
+    # reads the sheet and the board once, plans both directions against the current mappings and
+    # estimates the API calls and time the cycle would take under the configured rate limits.
+    # Mappings are not changed.
+    started = time.monotonic()
+
+    sheet_actions: List[Dict[str, Any]] = []
+    local = Counter()
+    rows = 0
+    for row in sheet.iter_rows():
+        rows += 1
+        action = plan_sheet_row(row, mappings)
+        if action is None:
+            continue
+        if action["kind"] in LOCAL_ACTIONS:
+            local[action["kind"]] += 1
+            continue
+        sheet_actions.append(action)
+
+    lists = trello.get_lists_by_name()
+    list_id_to_name = {v: k for k, v in lists.items()}
+    # Created by ensure_list_map at startup of a real run.
+    missing_lists = sorted(n for n in set(SHEET_TO_TRELLO.values()) if n and n not in lists)
+    board_cards = 0
+
+    def counted(cards):
+        nonlocal board_cards
+        for card in cards:
+            board_cards += 1
+            yield card
+
+    card_plans: List[Dict[str, Any]] = []
+    for sid, mapped, card_info in iter_mapped_cards(mappings, counted(trello.iter_cards_on_board())):
+        plan = plan_card_lead(mapped, card_info, list_id_to_name, trello.parse_desc_to_fields)
+        if plan is None:
+            continue
+        if plan["kind"] == "fingerprint":
+            local["card_fingerprint"] += 1
+            continue
+        card_plans.append({"action": plan["kind"], "sid": sid, "card_id": mapped.get("card_id"),
+                           "changes": plan["changes"]})
+
+    # Leads changed on both sides since the last sync; settled by CONFLICT_POLICY when the cycle runs.
+    pushed = {a["sid"] for a in sheet_actions if a["kind"] in ("patch", "archive")}
+    conflicts = sorted(p["sid"] for p in card_plans if p["action"] == "update" and p["sid"] in pushed)
+
+    # Trello calls of the real cycle: one POST/PUT per sheet action, plus a GET of the card per patch/archive
+    # when a conflict policy is on, else per patch that changes the description (merged into the card's
+    # current one); then the lists and the board read of the Trello -> sheet pass.
+    if resolver is not None and resolver.enabled:
+        checks = len(pushed)
+    else:
+        checks = sum(1 for a in sheet_actions
+                     if a["kind"] == "patch" and any(f in a["changes"] for f in DESC_FIELDS))
+    board_reads = 1 if CARD_PAGE_SIZE <= 0 else board_cards // CARD_PAGE_SIZE + 1
+    trello_writes = len(missing_lists) + len(sheet_actions)
+    trello_calls = trello_writes + checks + 1 + board_reads
+
+    # Sheets calls: the sheet read, then the write-back of every changed cell in chunked batches,
+    # preceded by one read of the written rows' id cells.
+    cells = sum(len(p["changes"]) for p in card_plans)
+    sheet_reads = (1 if READ_CHUNK_SIZE <= 0 else 1 + rows // READ_CHUNK_SIZE + 1) + (1 if cells else 0)
+    sheet_writes = math.ceil(cells / BATCH_CHUNK_SIZE) if BATCH_CHUNK_SIZE > 0 else min(cells, 1)
+
+    limiter = trello.limiter
+    workers = max(1, max_workers)
+    trello_seconds = max(_bucket_seconds(trello_calls, limiter.rate, limiter.capacity),
+                         (trello_writes + checks) * TRELLO_CALL_SECONDS / workers
+                         + (1 + board_reads) * TRELLO_CALL_SECONDS)
+    sheets_seconds = (sheet_reads + sheet_writes) * SHEETS_CALL_SECONDS \
+        + max(0, sheet_writes - SHEETS_WRITES_PER_MINUTE) * 60.0 / SHEETS_WRITES_PER_MINUTE
+
+    warnings = []
+    if limiter.rate <= 0 and trello_calls > TRELLO_TOKEN_LIMIT:
+        warnings.append(f"{trello_calls} Trello calls with the client rate limit off: over Trello's "
+                        f"{TRELLO_TOKEN_LIMIT} per {TRELLO_TOKEN_WINDOW:.0f}s token limit, expect 429s")
+    if sheet_writes > SHEETS_WRITES_PER_MINUTE:
+        warnings.append(f"{sheet_writes} sheet write requests: over the {SHEETS_WRITES_PER_MINUTE}/min "
+                        f"per-user quota")
+    if missing_lists:
+        warnings.append(f"Trello lists {', '.join(missing_lists)} don't exist yet and would be created")
+    if conflicts:
+        warnings.append(f"{len(conflicts)} leads changed on both sides")
+
+    summary = Counter(_label(a) for a in sheet_actions)
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "sheet_rows": rows,
+        "board_cards": board_cards,
+        "sheet_to_trello": [_sheet_entry(a) for a in sheet_actions],
+        "trello_to_sheet": card_plans,
+        "conflicts": conflicts,
+        "missing_lists": missing_lists,
+        "summary": {
+            "sheet_to_trello": dict(summary),
+            "trello_to_sheet": dict(Counter(p["action"] for p in card_plans)),
+            "state_only": dict(local),
+        },
+        "api_calls": {
+            "trello": {"reads": 1 + board_reads + checks, "writes": trello_writes, "total": trello_calls},
+            "sheets": {"reads": sheet_reads, "writes": sheet_writes, "total": sheet_reads + sheet_writes},
+        },
+        "estimated_seconds": {
+            "trello": round(trello_seconds, 1),
+            "sheets": round(sheets_seconds, 1),
+            # The two directions run one after the other.
+            "total": round(trello_seconds + sheets_seconds, 1),
+        },
+        "trello_quota_remaining": trello.quota_remaining,
+        "warnings": warnings,
+        "planning_seconds": round(time.monotonic() - started, 2),
+    }
+
+
+def write_plan(plan: Dict[str, Any], path: Optional[str] = None):
+    # "-" or None prints to stdout.
+    if not path or path == "-":
+        json.dump(plan, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    with open(path, "w") as f:
+        json.dump(plan, f, indent=2)
+    logger.info("Wrote sync plan to %s", path)
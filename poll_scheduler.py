@@ -0,0 +1,51 @@
+import logging
+from typing import Any, Dict, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger("sync")
+
+
+class AdaptivePollScheduler:
+    # Picks how long to sleep after each sync cycle instead of a fixed POLL_INTERVAL:
+    #  - a cycle that changed something drops the interval back to min_interval;
+    #  - every idle cycle multiplies it by `backoff`, up to max_interval;
+    #  - when the remaining API quota (0..1) is below low_quota it backs off even while busy;
+    #  - the interval is start-to-start, so the cycle's own run time is taken off the sleep.
+    def __init__(self, min_interval: float, max_interval: float, backoff: float = 2.0, low_quota: float = 0.2,
+                 labels: Optional[Dict[str, str]] = None):
+        self.min_interval = float(min_interval)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.backoff = max(1.0, float(backoff))
+        self.low_quota = low_quota
+        self.interval = self.min_interval
+        # Last decision, for logs and metrics: interval, delay, reason, changes, cycle_seconds, quota.
+        self.last: Dict[str, Any] = {}
+        self.decisions = {"changes": 0, "idle": 0, "low_quota": 0}
+        # Extra metric labels, e.g. {"pair": name} under the supervisor.
+        self.labels = labels or {}
+
+    def _grow(self):
+        self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def next_delay(self, changes: int, cycle_seconds: float, quota: Optional[float] = None) -> float:
+        if quota is not None and quota < self.low_quota:
+            reason = "low_quota"
+            self._grow()
+        elif changes:
+            reason = "changes"
+            self.interval = self.min_interval
+        else:
+            reason = "idle"
+            self._grow()
+        delay = max(0.0, self.interval - cycle_seconds)
+
+        self.decisions[reason] += 1
+        metrics.inc("poll_decisions_total", reason=reason, **self.labels)
+        metrics.set("poll_interval_seconds", self.interval, **self.labels)
+        metrics.set("poll_delay_seconds", delay, **self.labels)
+        self.last = {"interval": self.interval, "delay": delay, "reason": reason, "changes": changes,
+                     "cycle_seconds": cycle_seconds, "quota": quota}
+        logger.debug("Poll scheduler: %s (changes=%s, cycle %.2fs, quota=%s) -> interval %.1fs, sleeping %.1fs",
+                     reason, changes, cycle_seconds, quota, self.interval, delay)
+        return delay
@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from lead_mappings import MappingTable, MAPPING_FIELDS
+
+logger = logging.getLogger("sync")
+
+
+class StateStore(ABC):
+    # load() returns the state dict ({"mappings": ..., other keys}); save(state) persists it.
+    # Inside transaction(), saves are deferred and written once when the block exits.
+    def __init__(self, path: str):
+        self.path = path
+        self._depth = 0
+        self._deferred = None
+
+    @abstractmethod
+    def load(self) -> Dict[str, Any]:
+        ...
+
+    def save(self, state: Dict[str, Any]):
+        if self._depth:
+            self._deferred = state
+            return
+        self._write(state)
+
+    @abstractmethod
+    def _write(self, state: Dict[str, Any]):
+        ...
+
+    @contextmanager
+    def transaction(self):
+        self._depth += 1
+        try:
+            yield self
+        finally:
+            self._depth -= 1
+            if self._depth == 0 and self._deferred is not None:
+                state, self._deferred = self._deferred, None
+                self._write(state)
+
+    def close(self):
+        pass
+
+
+class JsonStateStore(StateStore):
+    def load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        except json.JSONDecodeError as e:
+            # Treating a damaged file as empty would re-create every card on the board.
+            raise RuntimeError(f"State file {self.path} is corrupt ({e}); restore it or move it aside") from e
+        state["mappings"] = MappingTable(state.get("mappings") or {})
+        return state
+
+    def _write(self, state: Dict[str, Any]):
+        mappings = state.get("mappings")
+        if isinstance(mappings, MappingTable):
+            mappings.take_dirty()
+            state = dict(state, mappings=mappings.to_dict())
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class SqliteStateStore(StateStore):
+    # mappings live in an indexed table (sid primary key, card_id index); other top-level state
+    # keys (e.g. the Trello actions cursor) are JSON values in a meta table.
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS mappings (sid TEXT PRIMARY KEY, "
+                f"{', '.join(f + ' TEXT' for f in MAPPING_FIELDS)}, extra TEXT)")
+            # Databases created before a field was added get the new column.
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(mappings)")}
+            for field in MAPPING_FIELDS:
+                if field not in columns:
+                    self.conn.execute(f"ALTER TABLE mappings ADD COLUMN {field} TEXT")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS mappings_card_id ON mappings (card_id)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._meta: Dict[str, str] = {}
+
+    def load(self) -> Dict[str, Any]:
+        mappings = {}
+        for row in self.conn.execute(f"SELECT sid, {', '.join(MAPPING_FIELDS)}, extra FROM mappings"):
+            mappings[row[0]] = self._record_from_row(row[1:])
+        state: Dict[str, Any] = {}
+        self._meta = {}
+        for key, value in self.conn.execute("SELECT key, value FROM meta"):
+            self._meta[key] = value
+            state[key] = json.loads(value)
+        state["mappings"] = MappingTable(mappings)
+        return state
+
+    @staticmethod
+    def _record_from_row(row) -> Dict[str, Any]:
+        record = {f: v for f, v in zip(MAPPING_FIELDS, row[:len(MAPPING_FIELDS)]) if v is not None}
+        if row[-1]:
+            record.update(json.loads(row[-1]))
+        return record
+
+    @staticmethod
+    def _row_from_record(sid: str, record: Dict[str, Any]):
+        extra = {k: v for k, v in record.items() if k not in MAPPING_FIELDS}
+        return (sid,) + tuple(record.get(f) for f in MAPPING_FIELDS) + (json.dumps(extra) if extra else None,)
+
+    def get_by_sid(self, sid: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(f"SELECT {', '.join(MAPPING_FIELDS)}, extra FROM mappings WHERE sid = ?",
+                                (sid,)).fetchone()
+        return self._record_from_row(row) if row else None
+
+    def get_by_card_id(self, card_id: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(f"SELECT sid, {', '.join(MAPPING_FIELDS)}, extra FROM mappings WHERE card_id = ?",
+                                (card_id,)).fetchone()
+        if not row:
+            return None
+        record = self._record_from_row(row[1:])
+        record["sid"] = row[0]
+        return record
+
+    def _write(self, state: Dict[str, Any]):
+        mappings = state.get("mappings") or {}
+        if isinstance(mappings, MappingTable):
+            sids = mappings.take_dirty()
+        else:
+            # Plain dict: no change tracking, so rewrite the table.
+            sids = None
+
+        meta = {k: json.dumps(v) for k, v in state.items() if k != "mappings"}
+        with self.conn:
+            if sids is None:
+                self.conn.execute("DELETE FROM mappings")
+                sids = set(mappings.keys())
+            upserts = [self._row_from_record(sid, mappings[sid]) for sid in sids if sid in mappings]
+            deletes = [(sid,) for sid in sids if sid not in mappings]
+            if upserts:
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO mappings (sid, {', '.join(MAPPING_FIELDS)}, extra) "
+                    f"VALUES ({', '.join('?' * (len(MAPPING_FIELDS) + 2))})", upserts)
+            if deletes:
+                self.conn.executemany("DELETE FROM mappings WHERE sid = ?", deletes)
+            changed_meta = [(k, v) for k, v in meta.items() if self._meta.get(k) != v]
+            if changed_meta:
+                self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", changed_meta)
+            removed_meta = [(k,) for k in self._meta if k not in meta]
+            if removed_meta:
+                self.conn.executemany("DELETE FROM meta WHERE key = ?", removed_meta)
+        self._meta = meta
+
+    def close(self):
+        self.conn.close()
+
+
+def open_state_store(path: str, backend: Optional[str] = None) -> StateStore:
+    # backend: "json" or "sqlite"; defaults to sqlite for .db/.sqlite/.sqlite3 paths.
+    if backend is None:
+        backend = "sqlite" if os.path.splitext(path)[1].lower() in (".db", ".sqlite", ".sqlite3") else "json"
+    if backend == "sqlite":
+        return SqliteStateStore(path)
+    if backend == "json":
+        return JsonStateStore(path)
+    raise RuntimeError(f"Unknown state backend '{backend}' (expected 'json' or 'sqlite')")
+
+
+def migrate_json_to_sqlite(json_path: str, db_path: str) -> int:
+    state = JsonStateStore(json_path).load()
+    store = SqliteStateStore(db_path)
+    try:
+        mappings = state.get("mappings") or {}
+        # Plain dict so every mapping is written, not just the dirty ones.
+        store.save(dict(state, mappings=dict(mappings)))
+    finally:
+        store.close()
+    return len(mappings)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python state_store.py <data.json> <state.db>")
+        sys.exit(2)
+    count = migrate_json_to_sqlite(sys.argv[1], sys.argv[2])
+    print(f"Migrated {count} mappings from {sys.argv[1]} to {sys.argv[2]}")
@@ -0,0 +1,304 @@
+import argparse
+import heapq
+import json
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+
+from poll_scheduler import AdaptivePollScheduler
+from metrics import metrics, start_metrics_server, profile_cycle
+
+load_dotenv()
+
+# Runs many sheet <-> board pairs from one config file, sharded across a process pool:
+#
+#   {
+#     "defaults": {"poll_interval": 30, "credentials_file": "credentials.json"},
+#     "pairs": [
+#       {"name": "team-a", "sheet_id": "...", "board_id": "..."},
+#       {"name": "team-b", "sheet_id": "...", "worksheet": "Leads", "board_id": "...",
+#        "trello_token": "...", "state_path": "state/team-b.db"}
+#     ]
+#   }
+#
+# Pair keys (any of them can also go in "defaults"): name, sheet_id, worksheet (index or tab title),
+# credentials_file, board_id, trello_api_key, trello_token, state_path, state_backend,
+# poll_interval, max_poll_interval, max_workers, rate_limit, rate_burst,
+# conflict_policy, conflict_owners. Credentials fall back to the usual env vars.
+
+SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", str(os.cpu_count() or 1)))
+SUPERVISOR_STATE_DIR = os.getenv("SUPERVISOR_STATE_DIR", "state")
+STATE_COMMIT = os.getenv("STATE_COMMIT", "lead")
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "2"))
+POLL_LOW_QUOTA = float(os.getenv("POLL_LOW_QUOTA", "0.2"))
+
+# Same metrics settings as main.py; worker numbers are merged here with a pair label.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_JSON_PATH = os.getenv("METRICS_JSON_PATH")
+SYNC_PROFILE_DIR = os.getenv("SYNC_PROFILE_DIR")
+
+PAIR_DEFAULTS = {
+    "worksheet": 0,
+    "credentials_file": os.getenv("CREDENTIALS_FILE"),
+    "trello_api_key": os.getenv("TRELLO_API_KEY"),
+    "trello_token": os.getenv("TRELLO_TOKEN"),
+    "state_backend": os.getenv("STATE_BACKEND") or None,
+    "poll_interval": int(os.getenv("POLL_INTERVAL") or "30"),
+    # None: 10x poll_interval, as in main.py.
+    "max_poll_interval": float(os.getenv("POLL_MAX_INTERVAL")) if os.getenv("POLL_MAX_INTERVAL") else None,
+    "max_workers": int(os.getenv("SYNC_MAX_WORKERS", "1")),
+    "rate_limit": None,
+    "rate_burst": None,
+    # See conflicts.py; conflict_owners is a {field: "sheet"|"trello"} object.
+    "conflict_policy": os.getenv("CONFLICT_POLICY", "sheet-wins").strip().lower(),
+    "conflict_owners": None,
+}
+
+logger = logging.getLogger("sync")
+
+
+def load_config(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r") as f:
+        config = json.load(f)
+    defaults = dict(PAIR_DEFAULTS, **(config.get("defaults") or {}))
+    state_dir = config.get("state_dir", SUPERVISOR_STATE_DIR)
+
+    pairs = []
+    for i, entry in enumerate(config.get("pairs") or []):
+        pair = dict(defaults, **entry)
+        pair.setdefault("name", f"pair-{i}")
+        missing = [k for k in ("sheet_id", "board_id", "credentials_file", "trello_api_key", "trello_token")
+                   if not pair.get(k)]
+        if missing:
+            raise RuntimeError(f"Pair '{pair['name']}' in {path} is missing {', '.join(missing)}")
+        # Each pair gets its own state file so mappings and cursors never mix between boards.
+        pair.setdefault("state_path", os.path.join(state_dir, f"{pair['name']}.json"))
+        pairs.append(pair)
+
+    for key in ("name", "state_path"):
+        dupes = [v for v, n in Counter(p[key] for p in pairs).items() if n > 1]
+        if dupes:
+            raise RuntimeError(f"Duplicate {key} in {path}: {', '.join(map(str, dupes))}")
+    return pairs
+
+
+def assign_rate_budgets(pairs: List[Dict[str, Any]], workers: int):
+    # Trello's 100 requests / 10s limit is per token. Pairs sharing a token split its budget by how
+    # many of them can run at once (at most one cycle per pair, at most `workers` cycles in total).
+    from task_client import RATE_LIMIT, RATE_BURST
+
+    sharing = Counter(p["trello_token"] for p in pairs)
+    for pair in pairs:
+        share = max(1, min(sharing[pair["trello_token"]], workers))
+        if pair.get("rate_limit") is None:
+            pair["rate_limit"] = RATE_LIMIT / share
+        if pair.get("rate_burst") is None:
+            pair["rate_burst"] = max(1.0, RATE_BURST / share)
+
+
+# --- worker process side ---
+
+# pair name -> (sheet, trello, store), kept for the life of the worker process so connections,
+# list ids and the sheet row index are reused when the same pair lands here again.
+_resources: Dict[str, Any] = {}
+_current_pair = "-"
+
+
+class _PairFilter(logging.Filter):
+    def filter(self, record):
+        record.pair = _current_pair
+        return True
+
+
+def _init_worker():
+    # Spawned workers start without the parent's logging setup; forked ones get it reconfigured.
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(pair)s] %(message)s"))
+    handler.addFilter(_PairFilter())
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    # A forked worker inherits whatever the supervisor has merged so far; don't ship it back.
+    metrics.take()
+
+
+def _pair_resources(pair: Dict[str, Any]):
+    if pair["name"] not in _resources:
+        from lead_client import GoogleSheetClient
+        from task_client import TrelloClient
+        from http_utils import TokenBucket
+        from state_store import open_state_store
+        from conflicts import ConflictResolver
+
+        sheet = GoogleSheetClient(pair["credentials_file"], pair["sheet_id"], worksheet=pair["worksheet"])
+        trello = TrelloClient(pair["trello_api_key"], pair["trello_token"], pair["board_id"],
+                              limiter=TokenBucket(pair["rate_limit"], pair["rate_burst"]))
+        trello.ensure_list_map(["TODO", "INPROGRESS", "DONE"])
+        state_dir = os.path.dirname(pair["state_path"])
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        store = open_state_store(pair["state_path"], pair["state_backend"])
+        resolver = ConflictResolver(pair["conflict_policy"], owners=pair["conflict_owners"],
+                                    sheet_time_source=sheet.modified_time)
+        _resources[pair["name"]] = (sheet, trello, store, resolver)
+    return _resources[pair["name"]]
+
+
+@contextmanager
+def _cycle_transaction(store):
+    if STATE_COMMIT == "cycle":
+        with store.transaction():
+            yield
+    else:
+        yield
+
+
+def run_pair_cycle(pair: Dict[str, Any]) -> Dict[str, Any]:
+    # One full sheet -> Trello -> sheet pass for one pair. State is reloaded every cycle because the
+    # previous cycle for this pair may have run in another worker process. Failures are returned as
+    # result["error"] rather than raised so the cycle's metrics still reach the supervisor.
+    global _current_pair
+    from sync_logic import sync_sheet_to_trello, sync_trello_to_sheet
+
+    _current_pair = pair["name"]
+    start = time.monotonic()
+    result = {"pair": pair["name"], "leads": 0, "changes": 0, "quota": None, "error": None}
+    try:
+        sheet, trello, store, resolver = _pair_resources(pair)
+        state = store.load()
+        mappings = state.setdefault("mappings", {})
+
+        def save(_path, st):
+            store.save(st)
+
+        metrics.inc("cycles_total", kind="full")
+        with profile_cycle(SYNC_PROFILE_DIR, f"{pair['name']}-{int(time.time() * 1000)}"), \
+                metrics.timer("cycle_seconds", kind="full"), _cycle_transaction(store):
+            changes = sync_sheet_to_trello(sheet, trello, mappings, state, save, pair["state_path"],
+                                           max_workers=pair["max_workers"], resolver=resolver)
+            changes += sync_trello_to_sheet(sheet, trello, mappings, state, save, pair["state_path"])
+        metrics.set("cycle_leads_changed", changes)
+        result.update(leads=len(mappings), changes=changes, quota=trello.quota_remaining)
+    except Exception as e:
+        logger.exception("Sync cycle failed")
+        metrics.inc("cycle_errors_total")
+        result["error"] = str(e)
+        # Clients may be half-initialised or holding a broken session; rebuild them next cycle.
+        resources = _resources.pop(pair["name"], None)
+        if resources:
+            resources[2].close()
+    finally:
+        _current_pair = "-"
+    result["seconds"] = time.monotonic() - start
+    result["metrics"] = metrics.take()
+    return result
+
+
+# --- supervisor side ---
+
+def run_supervisor(pairs: List[Dict[str, Any]], workers: int = SUPERVISOR_WORKERS, cycles: int = 0):
+    # Earliest-due-first over all pairs with at most one cycle in flight per pair. A huge board only
+    # ever holds one worker while the rest keep cycling, and overdue pairs are served oldest first so
+    # none of them can starve. Each pair's next due time comes from its own adaptive poll scheduler.
+    # cycles > 0 stops after each pair has run that many times.
+    workers = max(1, min(workers, len(pairs)))
+    assign_rate_budgets(pairs, workers)
+    logger.info("Supervising %d sheet/board pairs with %d worker processes", len(pairs), workers)
+
+    seq = 0
+    due = []
+    for pair in pairs:
+        heapq.heappush(due, (0.0, seq, pair))
+        seq += 1
+    runs = Counter()
+    schedulers = {
+        p["name"]: AdaptivePollScheduler(p["poll_interval"], p.get("max_poll_interval") or p["poll_interval"] * 10,
+                                         POLL_BACKOFF, POLL_LOW_QUOTA, labels={"pair": p["name"]})
+        for p in pairs
+    }
+
+    while due:
+        running = {}
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                while due or running:
+                    now = time.monotonic()
+                    while due and len(running) < workers and due[0][0] <= now:
+                        _, _, pair = heapq.heappop(due)
+                        running[pool.submit(run_pair_cycle, pair)] = (pair, now)
+
+                    if not running:
+                        time.sleep(max(0.0, due[0][0] - now))
+                        continue
+                    timeout = max(0.0, due[0][0] - now) if due and len(running) < workers else None
+                    done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        pair, started = running[future]
+                        changes, quota = 0, None
+                        try:
+                            result = future.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            logger.error("[%s] cycle failed: %s", pair["name"], e)
+                        else:
+                            metrics.merge(result["metrics"], pair=pair["name"])
+                            if result["error"]:
+                                logger.error("[%s] cycle failed: %s", pair["name"], result["error"])
+                            else:
+                                changes, quota = result["changes"], result["quota"]
+                                logger.info("[%s] cycle finished in %.2fs (%d leads, %d changed)",
+                                            pair["name"], result["seconds"], result["leads"], changes)
+                        del running[future]
+                        runs[pair["name"]] += 1
+                        if not cycles or runs[pair["name"]] < cycles:
+                            finished = time.monotonic()
+                            delay = schedulers[pair["name"]].next_delay(changes, finished - started, quota)
+                            heapq.heappush(due, (finished + delay, seq, pair))
+                            seq += 1
+                    if done and METRICS_JSON_PATH:
+                        try:
+                            metrics.write_json(METRICS_JSON_PATH)
+                        except OSError as e:
+                            logger.warning("Could not write metrics to %s: %s", METRICS_JSON_PATH, e)
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault); restart the pool and put the interrupted pairs back.
+            logger.error("Worker process died; restarting pool")
+            for pair, _ in running.values():
+                heapq.heappush(due, (time.monotonic(), seq, pair))
+                seq += 1
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run many sheet <-> Trello board syncs from one config file")
+    parser.add_argument("config", help="JSON file listing the sheet/board pairs")
+    parser.add_argument("--workers", type=int, default=SUPERVISOR_WORKERS,
+                        help="worker processes (default: SUPERVISOR_WORKERS or the CPU count)")
+    parser.add_argument("--cycles", type=int, default=0,
+                        help="stop after this many cycles per pair (default: run forever)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args(argv)
+    pairs = load_config(args.config)
+    if not pairs:
+        raise RuntimeError(f"No pairs configured in {args.config}")
+    if METRICS_PORT:
+        start_metrics_server(METRICS_HOST, METRICS_PORT)
+    run_supervisor(pairs, args.workers, args.cycles)
+
+
+if __name__ == "__main__":
+    main()
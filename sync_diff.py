@@ -0,0 +1,78 @@
+import hashlib
+from typing import Dict, Optional, Any, Callable, Iterable
+
+# Lead fields tracked in mappings and compared by the diff stage.
+LEAD_FIELDS = ("category", "name", "email", "note", "source")
+DESC_FIELDS = ("email", "note", "source")
+
+
+def _clean(value: Any) -> str:
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def sheet_row_id(row: Dict[str, Any]) -> str:
+    return _clean(row.get("id"))
+
+
+def normalize_sheet_row(row: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    sid = sheet_row_id(row)
+    if sid == "":
+        return None
+    lead = {"id": sid}
+    for field in LEAD_FIELDS:
+        lead[field] = _clean(row.get(field, ""))
+    lead["category"] = lead["category"].lower()
+    return lead
+
+
+def normalize_card(card: Dict[str, Any], list_id_to_name: Dict[str, str],
+                   list_to_category: Dict[str, str],
+                   parse_desc: Callable[[str], Dict[str, str]]) -> Dict[str, str]:
+    list_name = _clean(list_id_to_name.get(card.get("idList"))).lower()
+    parsed = parse_desc(card.get("desc") or "")
+    lead = {
+        "category": list_to_category.get(list_name, "") if list_name else "",
+        # Card titles are "<name> (LeadID: <sid>)".
+        "name": _clean(card.get("name")).split("(", 1)[0].strip(),
+    }
+    for field in DESC_FIELDS:
+        lead[field] = _clean(parsed.get(field))
+    return lead
+
+
+def normalize_mapping(mapped: Dict[str, Any]) -> Dict[str, str]:
+    lead = {field: _clean(mapped.get(field)) for field in LEAD_FIELDS}
+    lead["category"] = lead["category"].lower()
+    return lead
+
+
+def diff_lead(current: Dict[str, str], mapped: Dict[str, Any], fields: Iterable[str] = LEAD_FIELDS,
+              skip_empty: bool = False) -> Dict[str, str]:
+    # Returns {field: new_value} for every field where `current` differs from the stored mapping.
+    # skip_empty ignores blank values on the current side (Trello cards may omit desc lines).
+    known = normalize_mapping(mapped)
+    changes = {}
+    for field in fields:
+        value = current.get(field, "")
+        if skip_empty and value == "":
+            continue
+        if value != known[field]:
+            changes[field] = value
+    return changes
+
+
+def fingerprint(*parts: str) -> str:
+    # Stable across processes (unlike hash()), so it can be stored with the mapping.
+    return hashlib.blake2b("\x1f".join(parts).encode(), digest_size=8).hexdigest()
+
+
+def sheet_row_fingerprint(row: Dict[str, Any]) -> str:
+    # Raw cell values as read from the sheet, so unchanged rows skip normalization and diffing.
+    return fingerprint(*(str(row.get(field, "")) for field in LEAD_FIELDS))
+
+
+def card_fingerprint(card: Dict[str, Any]) -> str:
+    # Raw name/desc/idList, so unchanged cards skip description parsing entirely.
+    return fingerprint(card.get("name") or "", card.get("desc") or "", card.get("idList") or "")
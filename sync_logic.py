@@ -1,4 +1,12 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+
+from lead_mappings import sid_for_card_id, card_index
+from conflicts import parse_time, SHEET_UPDATED_AT_COLUMN
+from metrics import metrics
+from outbox import TRELLO, SHEET
+from sync_diff import (normalize_sheet_row, normalize_card, diff_lead, sheet_row_id, sheet_row_fingerprint,
+                       card_fingerprint, DESC_FIELDS)
 
 logger = logging.getLogger("sync")
 
@@ -6,7 +14,7 @@ SHEET_TO_TRELLO = {
     "new": "todo",
     "contacted": "inprogress",
     "qualified": "done",
-    "lost": None,   
+    "lost": None,
 }
 
 TRELLO_TO_SHEET = {
@@ -15,249 +23,479 @@ TRELLO_TO_SHEET = {
     "done": "qualified",
 }
 
-
-def sync_sheet_to_trello(sheet, trello, mappings, state, save_state_callback, data_json_path):
-    
-    rows = sheet.read_rows()
-    for r in rows:
-        sid_raw = r.get("id")
-        if sid_raw is None or str(sid_raw).strip() == "":
+# Key in the state file holding the date of the newest Trello board action already synced.
+ACTIONS_CURSOR_KEY = "trello_actions_cursor"
+
+# Action kinds that only touch local state, with no Trello call.
+LOCAL_ACTIONS = ("skip_lost", "fingerprint")
+
+
+def card_title(lead):
+    return f"{lead['name']} (LeadID: {lead['id']})"
+
+
+def card_desc(trello, lead):
+    return trello.render_fields_to_desc({"Email": lead["email"], "Note": lead["note"], "Source": lead["source"]})
+
+
+def mapping_record(card_id, lead, sheet_hash=None):
+    record = {
+        "card_id": card_id,
+        "category": lead["category"],
+        "name": lead["name"],
+        "email": lead["email"],
+        "note": lead["note"],
+        "source": lead["source"]
+    }
+    if sheet_hash:
+        record["sheet_hash"] = sheet_hash
+    return record
+
+
+def plan_sheet_lead(lead, mapped, sheet_hash=None):
+    # Decides what a sheet row needs on Trello; no API calls, so it is safe to run anywhere.
+    sid = lead["id"]
+    mapped_list_for_sheet = SHEET_TO_TRELLO.get(lead["category"])
+    action = {"sid": sid, "lead": lead, "list": mapped_list_for_sheet, "sheet_hash": sheet_hash}
+
+    if mapped is None:
+        action["kind"] = "create" if mapped_list_for_sheet else "skip_lost"
+        return action
+
+    card_id = mapped.get("card_id")
+    changes = diff_lead(lead, mapped)
+    if not changes:
+        # Row matches the mapping but its fingerprint is new (e.g. reformatted cell): just remember it.
+        if sheet_hash and mapped.get("sheet_hash") != sheet_hash:
+            action["kind"] = "fingerprint"
+            return action
+        return None
+    action["card_id"] = card_id
+    action["changes"] = changes
+    action["mapped"] = mapped
+
+    if "category" in changes and mapped_list_for_sheet is None:
+        action["kind"] = "archive"
+    elif not card_id:
+        if "category" not in changes:
+            return None
+        action["kind"] = "recreate"
+    else:
+        action["kind"] = "patch"
+    return action
+
+
+def _resolve_conflicts(trello, action, resolver):
+    # Reads the card before a sheet edit is pushed over it. Fields the policy gives to Trello are
+    # dropped from the push.
+    # Only changes this lead's own action (kind, changes, lead), so it is safe on a worker thread.
+    mapped = action["mapped"]
+    card = trello.find_open_card(action["card_id"])
+    if card is None:
+        return
+    # Saves apply_card_patch its own read of the description.
+    action["card"] = card
+    activity = card.get("dateLastActivity")
+    if activity and activity == mapped.get("card_activity"):
+        # Untouched since the last reconcile.
+        return
+    list_id_to_name = {v: k for k, v in trello.lists.items()}
+    card_lead = normalize_card(card, list_id_to_name, TRELLO_TO_SHEET, trello.parse_desc_to_fields)
+    card_changes = diff_lead(card_lead, mapped, skip_empty=True)
+    if not card_changes:
+        return
+
+    # An updated-at cell that didn't move since the last sync doesn't date this edit.
+    raw_time = action.get("sheet_time")
+    sheet_time = parse_time(raw_time) if raw_time and str(raw_time) != mapped.get("sheet_updated") else None
+    if sheet_time is None:
+        sheet_time = resolver.fallback_sheet_time()
+    push, kept = resolver.resolve(action["sid"], action["changes"], card_changes, sheet_time, parse_time(activity))
+    action["lead"] = dict(action["lead"], **{f: v for f, v in card_changes.items() if f not in push})
+    action["changes"] = push
+    action["kept"] = sorted(kept)
+    if action["kind"] == "archive" and "category" in kept:
+        action["kind"] = "patch"
+
+
+def plan_card_lead(mapped, card_info, list_id_to_name, parse_desc):
+    # Decides what a card needs on the sheet; no API calls. None when the card is unchanged since the
+    # last reconcile; kind "lost" when it is gone from the board, "fingerprint" when only its raw
+    # fields moved (e.g. reformatted description), else "update" with the sheet changes.
+    if not card_info:
+        return {"kind": "lost", "changes": {"category": "LOST"}}
+    # Unchanged card since the last reconcile: skip parsing the description.
+    card_hash = card_fingerprint(card_info)
+    if mapped.get("card_hash") == card_hash:
+        return None
+    # Category, title and description changes from trello to Google sheet.
+    card_lead = normalize_card(card_info, list_id_to_name, TRELLO_TO_SHEET, parse_desc)
+    changes = diff_lead(card_lead, mapped, skip_empty=True)
+    return {"kind": "update" if changes else "fingerprint", "changes": changes, "card_hash": card_hash,
+            "activity": card_info.get("dateLastActivity")}
+
+
+def iter_mapped_cards(mappings, cards):
+    # (sid, mapping, card) for every mapped lead from one streamed read of the board's cards, matched
+    # through the card_id index; card is None for mappings whose card never showed up (deleted or
+    # archived), yielded once the whole board has been read.
+    index = card_index(mappings)
+    seen = set()
+    for card_info in cards:
+        sid = index.get(card_info.get("id"))
+        if sid is None or sid not in mappings:
             continue
-        sid = str(sid_raw).strip()
-        name = str(r.get("name", "")).strip()
-        email = str(r.get("email", "")).strip()
-        note = str(r.get("note", "")).strip()
-        source = str(r.get("source", "")).strip()
-        sheet_category_raw = str(r.get("category", "")).strip().lower()
-
-        mapped_list_for_sheet = SHEET_TO_TRELLO.get(sheet_category_raw)
-
-        if sid not in mappings:
-            if mapped_list_for_sheet:
-                card_name = f"{name} (LeadID: {sid})"
-                desc_fields = {"Email": email, "Note": note, "Source": source}
-                desc = trello.render_fields_to_desc(desc_fields)
-                try:
-                    card_id = trello.create_card(mapped_list_for_sheet, card_name, desc)
-                    mappings[sid] = {
-                        "card_id": card_id,
-                        "category": sheet_category_raw,
-                        "name": name,
-                        "email": email,
-                        "note": note,
-                        "source": source
-                    }
-                    save_state_callback(data_json_path, state)
-                    logger.info("Created card for sheet id=%s -> trello card id=%s (list=%s)", sid, card_id,
-                                mapped_list_for_sheet)
-                except Exception as e:
-                    logger.exception("Failed creating card for sheet id=%s: %s", sid, e)
+        seen.add(card_info.get("id"))
+        yield sid, mappings[sid], card_info
+    for sid, mapped in list(mappings.items()):
+        if mapped.get("card_id") and mapped.get("card_id") not in seen:
+            yield sid, mapped, None
+
+
+def execute_sheet_action(trello, action, outbox=None, resolver=None):
+    # Trello calls for one lead; runs on a worker thread in concurrent mode, so it must not touch state.
+    # With an outbox, archives and patches are queued there (and sent by its drainer) instead;
+    # creates stay synchronous because the mapping needs the new card id.
+    # resolver (conflicts.ConflictResolver) checks the card for edits made since the last sync first.
+    if (resolver is not None and resolver.enabled and action["kind"] in ("patch", "archive")
+            and action.get("card_id")):
+        _resolve_conflicts(trello, action, resolver)
+    kind = action["kind"]
+    lead = action["lead"]
+    sid = lead["id"]
+    if kind in ("create", "recreate"):
+        return trello.create_card(action["list"], card_title(lead), card_desc(trello, lead))
+    if kind == "archive":
+        if action["card_id"]:
+            if outbox is not None:
+                outbox.put(TRELLO, sid, {"card_id": action["card_id"], "archive": True})
             else:
-                logger.info("Sheet id=%s is LOST; not creating Trello card (by design)", sid)
+                trello.archive_card(action["card_id"])
+        return action["card_id"]
+    if kind == "patch":
+        changes = action["changes"]
+        # One PUT carries the whole change set: title, description and list. Only the changed
+        # description fields are sent; the rest keep the card's current values.
+        fields = {f: lead[f] for f in DESC_FIELDS if f in changes}
+        patch = {
+            "name": card_title(lead) if "name" in changes else None,
+            "list": action["list"] if "category" in changes else None,
+            "fields": fields or None,
+        }
+        if outbox is not None:
+            outbox.put(TRELLO, sid, dict(patch, card_id=action["card_id"]))
         else:
-            mapped = mappings[sid]
-            mapped_category = (mapped.get("category") or "").strip().lower()
-            card_id = mapped.get("card_id")
-
-            if sheet_category_raw != mapped_category:
-                if mapped_list_for_sheet is None:
-                    if card_id:
-                        try:
-                            trello.archive_card(card_id)
-                            logger.info("Archived Trello card %s because sheet id %s changed to LOST", card_id, sid)
-                        except Exception as e:
-                            logger.exception("Failed to archive Trello card %s for sid %s: %s", card_id, sid, e)
-                    mappings.pop(sid, None)
-                    save_state_callback(data_json_path, state)
-                else:
-                    try:
-                        trello.get_lists_by_name()
-                        if not card_id:
-                            card_name = f"{name} (LeadID: {sid})"
-                            desc = trello.render_fields_to_desc({"Email": email, "Note": note, "Source": source})
-                            card_id = trello.create_card(mapped_list_for_sheet, card_name, desc)
-                            mappings[sid] = {
-                                "card_id": card_id,
-                                "category": sheet_category_raw,
-                                "name": name,
-                                "email": email,
-                                "note": note,
-                                "source": source
-                            }
-                            save_state_callback(data_json_path, state)
-                            logger.info("Re-created Trello card for sheet id=%s -> %s", sid, card_id)
-                        else:
-                            trello.move_card(card_id, mapped_list_for_sheet)
-                            trello.update_card_fields(card_id, {"email": email, "note": note, "source": source})
-                            mapped["category"] = sheet_category_raw
-                            mapped["name"] = name
-                            mapped["email"] = email
-                            mapped["note"] = note
-                            mapped["source"] = source
-                            save_state_callback(data_json_path, state)
-                            logger.info(
-                                "Moved Trello card %s -> list %s (sheet id %s changed category)", card_id,
-                                mapped_list_for_sheet, sid)
-                    except Exception as e:
-                        logger.exception("Failed handling category change for sid %s: %s", sid, e)
-
-           
-            mapped_name = (mapped.get("name") or "").strip()
-            if name  != mapped_name and card_id:
-                try:
-                    trello.update_card_name(card_id, f"{name} (LeadID: {sid})")
-                    mapped["name"] = name
-                    save_state_callback(data_json_path, state)
-                    logger.info("Updated Trello card %s title -> %s (due to sheet change)", card_id, name)
-                except Exception as e:
-                    logger.exception("Failed to update Trello card title for %s: %s", card_id, e)
-
-            
-            if card_id:
-                to_update = {}
-                if email != (mapped.get("email") or "").strip():
-                    to_update["email"] = email
-                if note != (mapped.get("note") or "").strip():
-                    to_update["note"] = note
-                if source != (mapped.get("source") or "").strip():
-                    to_update["source"] = source
-                if to_update:
-                    try:
-                        trello.update_card_fields(card_id, to_update)
-                        mapped.update(
-                            {k: v for k, v in {"email": email, "note": note, "source": source}.items() if
-                             (k in to_update)})
-                        save_state_callback(data_json_path, state)
-                        logger.info("Updated Trello card %s desc fields -> %s", card_id, list(to_update.keys()))
-                    except Exception as e:
-                        logger.exception("Failed to update Trello card desc for %s: %s", card_id, e)
-
+            trello.apply_card_patch(action["card_id"], name=patch["name"], list_name=patch["list"],
+                                    fields=patch["fields"], card=action.get("card"))
+        return action["card_id"]
+    return None
+
+
+def apply_sheet_action(mappings, action, card_id, error, state, save_state_callback, data_json_path):
+    # Applies the outcome of execute_sheet_action to mappings; always runs on the calling thread.
+    kind = action["kind"]
+    sid = action["sid"]
+    lead = action["lead"]
+
+    if kind == "skip_lost":
+        logger.info("Sheet id=%s is LOST; not creating Trello card (by design)", sid)
+        return
+
+    if kind == "fingerprint":
+        # Saved with the next state write; not worth a write of its own.
+        mappings[sid]["sheet_hash"] = action["sheet_hash"]
+        if action.get("sheet_time"):
+            mappings[sid]["sheet_updated"] = str(action["sheet_time"])
+        return
+
+    if kind == "archive":
+        if error is not None:
+            logger.error("Failed to archive Trello card %s for sid %s: %s", action["card_id"], sid, error,
+                         exc_info=error)
+        elif card_id:
+            logger.info("Archived Trello card %s because sheet id %s changed to LOST", card_id, sid)
+        mappings.pop(sid, None)
+        save_state_callback(data_json_path, state)
+        return
+
+    if error is not None:
+        if kind == "create":
+            logger.error("Failed creating card for sheet id=%s: %s", sid, error, exc_info=error)
+        elif kind == "recreate":
+            logger.error("Failed handling category change for sid %s: %s", sid, error, exc_info=error)
+        else:
+            logger.error("Failed to update Trello card %s for sid %s: %s", action["card_id"], sid, error,
+                         exc_info=error)
+        return
+
+    if kind in ("create", "recreate"):
+        mappings[sid] = mapping_record(card_id, lead, action["sheet_hash"])
+        if action.get("sheet_time"):
+            mappings[sid]["sheet_updated"] = str(action["sheet_time"])
+        save_state_callback(data_json_path, state)
+        if kind == "create":
+            logger.info("Created card for sheet id=%s -> trello card id=%s (list=%s)", sid, card_id, action["list"])
+        else:
+            logger.info("Re-created Trello card for sheet id=%s -> %s", sid, card_id)
+    elif kind == "patch":
+        mappings[sid].update(action["changes"])
+        if action["sheet_hash"]:
+            mappings[sid]["sheet_hash"] = action["sheet_hash"]
+        if action.get("sheet_time"):
+            mappings[sid]["sheet_updated"] = str(action["sheet_time"])
+        # The card was just rewritten, so the stored card fingerprint no longer describes it.
+        mappings[sid].pop("card_hash", None)
+        save_state_callback(data_json_path, state)
+        if action.get("kept"):
+            logger.info("Kept Trello values of %s for sid %s (newer/owned on the card)", action["kept"], sid)
+        if action["changes"]:
+            logger.info("Updated Trello card %s fields %s (due to sheet change for id %s)", card_id,
+                        sorted(action["changes"].keys()), sid)
+
+
+def _run_sheet_action(trello, action, outbox=None, resolver=None):
+    try:
+        return execute_sheet_action(trello, action, outbox, resolver), None
+    except Exception as e:
+        return None, e
+
+
+def plan_sheet_row(row, mappings, outbox=None):
+    sid = sheet_row_id(row)
+    if sid == "":
+        return None
+    # A Trello -> sheet write for this row is still queued: the row shows pre-write values.
+    if outbox is not None and outbox.has(SHEET, sid):
+        return None
+    mapped = mappings.get(sid)
+    row_hash = sheet_row_fingerprint(row)
+    # Unchanged since the last reconcile: one hash comparison, no normalization or diff.
+    if mapped is not None and mapped.get("sheet_hash") == row_hash:
+        return None
+    action = plan_sheet_lead(normalize_sheet_row(row), mapped, row_hash)
+    if action is not None:
+        action["sheet_time"] = row.get(SHEET_UPDATED_AT_COLUMN)
+    return action
+
+
+@metrics.timed("phase_seconds", phase="sheet_to_trello")
+def sync_sheet_to_trello(sheet, trello, mappings, state, save_state_callback, data_json_path, max_workers=1,
+                         only_ids=None, outbox=None, resolver=None):
+    # max_workers > 1 sends Trello mutations for different leads in parallel (bounded by the pool and
+    # by the client's rate limiter). Mapping/state updates are still applied on this thread.
+    # only_ids limits the pass to those sheet ids (e.g. queued by the webhook receiver).
+    # outbox (outbox.Outbox) queues card updates/archives for its drainer instead of sending them here.
+    # resolver (conflicts.ConflictResolver) settles leads edited on both sides; see _resolve_conflicts.
+    # Returns the number of leads sent to Trello (created, updated or archived).
+
+    # iter_rows streams the sheet in chunks when SHEET_READ_CHUNK_SIZE is set; rows are consumed once.
+    rows = sheet.iter_rows() if only_ids is None else sheet.read_rows_by_ids(list(only_ids))
+    fingerprinted = False
+    changed = 0
+    if resolver is not None and resolver.enabled:
+        resolver.start_pass()
+        if not trello.lists:
+            trello.get_lists_by_name()
+
+    if max_workers <= 1:
+        for r in rows:
+            action = plan_sheet_row(r, mappings, outbox)
+            if action is None:
+                continue
+            if action["kind"] in LOCAL_ACTIONS:
+                card_id, error = None, None
+                fingerprinted = fingerprinted or action["kind"] == "fingerprint"
+            else:
+                card_id, error = _run_sheet_action(trello, action, outbox, resolver)
+                changed += 1
+            apply_sheet_action(mappings, action, card_id, error, state, save_state_callback, data_json_path)
+        if fingerprinted:
+            save_state_callback(data_json_path, state)
+        metrics.inc("leads_changed_total", changed, direction="sheet_to_trello")
+        return changed
+
+    if not trello.lists:
+        trello.get_lists_by_name()
+
+    inflight = {}  # sid -> (future, action); one in-flight action per lead keeps same-card updates in order
+
+    def collect(done_future, action):
+        card_id, error = done_future.result()
+        apply_sheet_action(mappings, action, card_id, error, state, save_state_callback, data_json_path)
+
+    def collect_done(block):
+        if not inflight:
+            return
+        done, _ = wait([f for f, _ in inflight.values()], return_when=FIRST_COMPLETED if block else ALL_COMPLETED)
+        for sid, (f, action) in list(inflight.items()):
+            if f in done:
+                inflight.pop(sid)
+                collect(f, action)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for r in rows:
+            sid = sheet_row_id(r)
+            if sid in inflight:
+                # Duplicate id in the sheet: wait for the earlier row so it is planned against fresh state.
+                f, action = inflight.pop(sid)
+                collect(f, action)
+            action = plan_sheet_row(r, mappings, outbox)
+            if action is None:
+                continue
+            if action["kind"] in LOCAL_ACTIONS:
+                fingerprinted = fingerprinted or action["kind"] == "fingerprint"
+                apply_sheet_action(mappings, action, None, None, state, save_state_callback, data_json_path)
+                continue
+            inflight[sid] = (pool.submit(_run_sheet_action, trello, action, outbox, resolver), action)
+            changed += 1
+            if len(inflight) >= max_workers * 2:
+                collect_done(block=True)
+        collect_done(block=False)
+    if fingerprinted:
+        save_state_callback(data_json_path, state)
+    metrics.inc("leads_changed_total", changed, direction="sheet_to_trello")
+    return changed
+
+
+def changed_card_ids(actions):
+    ids = set()
+    for a in actions:
+        card = (a.get("data") or {}).get("card") or {}
+        if card.get("id"):
+            ids.add(card["id"])
+    return ids
+
+
+@metrics.timed("phase_seconds", phase="trello_to_sheet")
+def sync_trello_to_sheet(sheet, trello, mappings, state, save_state_callback, data_json_path, card_ids=None,
+                         use_actions=False, outbox=None):
+    # card_ids limits the pass to those cards (e.g. queued by the webhook receiver); each is fetched
+    # on its own instead of downloading the whole board.
+    # use_actions reads /boards/{id}/actions since the cursor kept in state and only syncs the cards
+    # those actions touched. Without a cursor yet it does a full pass and starts the cursor there.
+    # outbox (outbox.Outbox): sheet writes that fail in the batch are queued there for retry, and cards
+    # with a queued sheet -> Trello update are left alone until it has been sent.
+    # Returns the number of sheet rows changed (including rows marked LOST).
+
+    # Sheet writes are buffered per lead and sent in one batch at the end of the pass.
+    # pending[sid] holds (changes, card_id, card_hash, card_activity) to apply to the mapping once the write lands.
+    pending = {}
+    new_cursor = None
+    fingerprinted = False
+    lost = 0
 
-def sync_trello_to_sheet(sheet, trello, mappings, state, save_state_callback, data_json_path):
-    
     try:
-        cards = trello.get_cards_on_board()
+        if use_actions and card_ids is None:
+            cursor = state.get(ACTIONS_CURSOR_KEY)
+            # Without a cursor only the newest action is needed to start one.
+            actions = trello.get_board_actions(since=cursor) if cursor else trello.get_board_actions(limit=1)
+            new_cursor = actions[0].get("date") if actions else cursor
+            if cursor:
+                card_ids = changed_card_ids(actions)
+
         lists = trello.get_lists_by_name()
         list_id_to_name = {v: k for k, v in lists.items()}
-        cards_by_id = {c.get("id"): c for c in cards}
+        # Sheet id -> row. A full pass follows the index built by the sheet read earlier in the cycle;
+        # with card_ids it is replaced by rows checked against the sheet (see below), as the index can
+        # be up to FULL_SYNC_INTERVAL old by then. flush_updates re-checks them either way.
+        find_row = sheet.find_row_index_by_id
 
-        for sid, mapped in list(mappings.items()):
+        def reconcile(sid, mapped, card_info):
+            nonlocal fingerprinted, lost
             card_id = mapped.get("card_id")
-            if not card_id:
-                continue
-            
-
+            # The card doesn't have the queued sheet -> Trello change yet; it would be copied back.
+            if outbox is not None and outbox.has(TRELLO, sid):
+                return
 
+            plan = plan_card_lead(mapped, card_info, list_id_to_name, trello.parse_desc_to_fields)
+            if plan is None:
+                return
 
             # Deleting data from Google sheet and Json file.
-            card_info = cards_by_id.get(card_id)
-            if not card_info:
+            if plan["kind"] == "lost":
                 logger.info("Card %s for sheet id %s missing/archived; setting sheet category to LOST", card_id, sid)
-                row_index = sheet.find_row_index_by_id(sid)
+                row_index = find_row(sid)
                 if row_index:
                     try:
-                        sheet.update_category_by_row_index(row_index, "LOST")
+                        sheet.queue_row_update(row_index, plan["changes"], key=sid)
+                        lost += 1
                     except Exception as e:
                         logger.exception("Failed setting sheet category to LOST for sid %s: %s", sid, e)
                 mappings.pop(sid, None)
                 save_state_callback(data_json_path, state)
-                continue
-
-
-
-            # Category change from trello to Google sheet-
-
-            current_list_id = card_info.get("idList")
-            current_list_name = list_id_to_name.get(current_list_id, None)
-            if current_list_name:
-                current_list_name = current_list_name.lower().strip()
-            mapped_category = (mapped.get("category") or "").strip().lower()
-
-            mapped_sheet_cat = TRELLO_TO_SHEET.get(current_list_name) if current_list_name else None
-            if mapped_sheet_cat and mapped_sheet_cat != mapped_category:
-                row_index = sheet.find_row_index_by_id(sid)
-                if row_index:
-                    try:
-                        sheet.update_category_by_row_index(row_index, mapped_sheet_cat)
-                        mapped["category"] = mapped_sheet_cat
-                        save_state_callback(data_json_path, state)
-                        logger.info("Updated sheet row %s category -> %s because Trello card %s moved", sid,
-                                    mapped_sheet_cat, card_id)
-                    except Exception as e:
-                        logger.exception("Failed updating sheet category for sid %s: %s", sid, e)
-
-            # Desption of Card- 
-            card_desc = card_info.get("desc") or ""
-            parsed = trello.parse_desc_to_fields(card_desc)
-            trello_card_email = (parsed.get("email") or "").strip()
-            trello_card_note = (parsed.get("note") or "").strip()
-            trello_card_source = (parsed.get("source") or "").strip()
-
-
-            trello_card_name = card_info.get("name", "").strip()
-            trello_card_name_clean = trello_card_name.split("(", 1)[0].strip()
-            trello_card_name = trello_card_name_clean
-            mapped_name = (mapped.get("name") or "").strip()
-
-
-            # Updation of name from trello to card.
-
-            if trello_card_name and trello_card_name != mapped_name:
-                row_index = sheet.find_row_index_by_id(sid)
-                if row_index:
-                    try:
-                        sheet.update_name_by_row_index(row_index, trello_card_name)
-                        mapped["name"] = trello_card_name
-                        save_state_callback(data_json_path, state)
-                        logger.info("Updated sheet row %s name -> %s because Trello card %s title changed", sid,
-                                    trello_card_name, card_id)
-                    except Exception as e:
-                        logger.exception("Failed updating sheet name for sid %s: %s", sid, e)
-
-            # Updation of email from trello to card.
-
-            mapped_email = (mapped.get("email") or "").strip()
-            if trello_card_email and trello_card_email != mapped_email:
-                row_index = sheet.find_row_index_by_id(sid)
-                if row_index:
-                    try:
-                        sheet.update_email_by_row_index(row_index, trello_card_email)
-                        mapped["email"] = trello_card_email
-                        save_state_callback(data_json_path, state)
-                        logger.info("Updated sheet row %s email -> %s because Trello card %s desc changed", sid,
-                                    trello_card_email, card_id)
-                    except Exception as e:
-                        logger.exception("Failed updating sheet email for sid %s: %s", sid, e)
-
-            # Updation of note from trello to card.
-
-            mapped_note = (mapped.get("note") or "").strip()
-            if trello_card_note and trello_card_note != mapped_note:
-                row_index = sheet.find_row_index_by_id(sid)
-                if row_index:
-                    try:
-                        sheet.update_note_by_row_index(row_index, trello_card_note)
-                        mapped["note"] = trello_card_note
-                        save_state_callback(data_json_path, state)
-                        logger.info("Updated sheet row %s note -> %s because Trello card %s desc changed", sid,
-                                    trello_card_note, card_id)
-                    except Exception as e:
-                        logger.exception("Failed updating sheet note for sid %s: %s", sid, e)
+                return
+
+            changes, card_hash, activity = plan["changes"], plan["card_hash"], plan["activity"]
+            if plan["kind"] == "fingerprint":
+                mapped["card_hash"] = card_hash
+                if activity:
+                    mapped["card_activity"] = activity
+                fingerprinted = True
+                return
+
+            row_index = find_row(sid)
+            if row_index:
+                try:
+                    sheet.queue_row_update(row_index, changes, key=sid)
+                    pending[sid] = (changes, card_id, card_hash, activity)
+                except Exception as e:
+                    logger.exception("Failed updating sheet fields %s for sid %s: %s", sorted(changes), sid, e)
 
-            # Updation of source from trello to card.
+        if card_ids is None:
+            # Cards are streamed page by page.
+            for sid, mapped, card_info in iter_mapped_cards(mappings, trello.iter_cards_on_board()):
+                reconcile(sid, mapped, card_info)
+        else:
+            sids = [sid for sid in (sid_for_card_id(mappings, c) for c in set(card_ids))
+                    if sid is not None and sid in mappings]
+            # One batch_get of the leads' id cells (and an id-column reload if rows moved).
+            rows = sheet.verified_row_indexes(sids) if sids else {}
+            find_row = rows.get
+            for sid in sids:
+                reconcile(sid, mappings[sid], trello.find_open_card(mappings[sid]["card_id"]))
 
-            mapped_source = (mapped.get("source") or "").strip()
-            if trello_card_source and trello_card_source != mapped_source:
-                row_index = sheet.find_row_index_by_id(sid)
-                if row_index:
-                    try:
-                        sheet.update_source_by_row_index(row_index, trello_card_source)
-                        mapped["source"] = trello_card_source
-                        save_state_callback(data_json_path, state)
-                        logger.info("Updated sheet row %s source -> %s because Trello card %s desc changed", sid,
-                                    trello_card_source, card_id)
-                    except Exception as e:
-                        logger.exception("Failed updating sheet source for sid %s: %s", sid, e)
+    except Exception as e:
+        logger.exception("Error while pulling Trello board/cards: %s", e)
+        new_cursor = None
 
+    try:
+        with metrics.timer("phase_seconds", phase="sheet_write_back"):
+            failures = sheet.flush_updates()
     except Exception as e:
-        logger.exception("Error while pulling Trello board/cards: %s", e)
\ No newline at end of file
+        logger.exception("Failed flushing sheet updates: %s", e)
+        failures = {sid: e for sid in pending}
+
+    for sid, err in list(failures.items()):
+        changes = pending[sid][0] if sid in pending else {"category": "LOST"}
+        if outbox is not None:
+            # Hand the write to the outbox and count it as done, so mappings and the cursor move on.
+            logger.warning("Sheet write for sid %s failed (%s); queued fields %s for retry", sid, err, sorted(changes))
+            outbox.put(SHEET, sid, {"changes": changes})
+            failures.pop(sid)
+            continue
+        logger.error("Failed updating sheet fields %s for sid %s: %s", sorted(changes), sid, err)
+
+    changed = fingerprinted
+    updated = 0
+    for sid, (changes, card_id, card_hash, activity) in pending.items():
+        if sid in failures:
+            continue
+        updated += 1
+        mapped = mappings.get(sid)
+        if mapped is not None:
+            mapped.update(changes)
+            mapped["card_hash"] = card_hash
+            if activity:
+                mapped["card_activity"] = activity
+            # The row was just rewritten, so the stored row fingerprint no longer describes it.
+            mapped.pop("sheet_hash", None)
+            changed = True
+        logger.info("Updated sheet row %s fields %s because Trello card %s changed", sid, sorted(changes), card_id)
+    # Keep the old cursor if any write failed so those cards are picked up again next pass.
+    if new_cursor and new_cursor != state.get(ACTIONS_CURSOR_KEY) and not failures:
+        state[ACTIONS_CURSOR_KEY] = new_cursor
+        changed = True
+    if changed:
+        save_state_callback(data_json_path, state)
+    metrics.inc("leads_changed_total", updated + lost, direction="trello_to_sheet")
+    return updated + lost
@@ -1,8 +1,13 @@
 import os
+import time
+import logging
 import requests
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Iterator
 from dotenv import load_dotenv
-import re
+
+from desc_codec import parse_desc, render_desc, extract_email
+from http_utils import make_session, TokenBucket, RetryPolicy
+from metrics import metrics
 
 load_dotenv()
 
@@ -10,45 +15,112 @@ API_KEY = os.getenv("TRELLO_API_KEY")
 TOKEN = os.getenv("TRELLO_TOKEN")
 BOARD_ID = os.getenv("TRELLO_BOARD_ID")
 BASE = "https://api.trello.com/1"
+POOL_SIZE = int(os.getenv("TRELLO_POOL_SIZE", "10"))
+RATE_LIMIT = float(os.getenv("TRELLO_RATE_LIMIT", "9"))
+RATE_BURST = float(os.getenv("TRELLO_RATE_BURST", "10"))
+MAX_RETRIES = int(os.getenv("TRELLO_MAX_RETRIES", "5"))
+REQUEST_TIMEOUT = 15
+
+# Card fields the sync reads; everything else (badges, labels, members, ...) is left out of responses.
+CARD_FIELDS = "id,name,desc,idList,closed,dateLastActivity"
+# Cards per page for board reads; 0 fetches the board in one request.
+CARD_PAGE_SIZE = int(os.getenv("TRELLO_CARD_PAGE_SIZE", "0"))
+
+# Board action types that can change a synced card.
+CARD_ACTION_FILTER = "createCard,updateCard,deleteCard,copyCard,moveCardToBoard,moveCardFromBoard"
+
+logger = logging.getLogger("sync")
+
+
+def _timed(call):
+    return metrics.timed("client_call_seconds", client="trello", call=call)
+
 
-if not (API_KEY and TOKEN and BOARD_ID):
-    raise RuntimeError("Set TRELLO_API_KEY, TRELLO_TOKEN and BOARD_ID (or TRELLO_BOARD_ID) in env or file")
+def _timed_iter(call):
+    return metrics.timed_iter("client_call_seconds", client="trello", call=call)
 
 
 class TrelloClient:
-    def __init__(self, api_key=API_KEY, token=TOKEN, board_id=BOARD_ID):
+    def __init__(self, api_key=API_KEY, token=TOKEN, board_id=BOARD_ID, base_url=BASE, pool_size=POOL_SIZE,
+                 limiter: Optional[TokenBucket] = None, retry: Optional[RetryPolicy] = None,
+                 session: Optional[requests.Session] = None):
+        # Checked here rather than at import so the supervisor can pass per-board credentials.
+        if not (api_key and token and board_id):
+            raise RuntimeError("Set TRELLO_API_KEY, TRELLO_TOKEN and BOARD_ID (or TRELLO_BOARD_ID) in env or file")
         self.key = api_key
         self.token = token
         self.board_id = board_id
+        self.base_url = base_url.rstrip("/")
+        self.session = session or make_session(pool_size)
+        metrics.instrument_session(self.session, "trello")
+        self.limiter = limiter or TokenBucket(RATE_LIMIT, RATE_BURST)
+        self.retry = retry or RetryPolicy(max_retries=MAX_RETRIES)
         self.lists = {}  
+        # Fraction (0..1) of Trello's per-token/per-key request window left, from the last response.
+        self.quota_remaining: Optional[float] = None
+
+    def _request(self, method, path, params=None, data=None):
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            waited = self.limiter.acquire()
+            if waited:
+                metrics.inc("trello_rate_limit_wait_seconds_total", waited)
+            try:
+                r = self.session.request(method, url, params=params, data=data, timeout=REQUEST_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not self.retry.should_retry(attempt, method):
+                    raise
+                delay = self.retry.delay(attempt)
+                metrics.inc("trello_retries_total", reason="connection")
+                logger.warning("Trello %s %s failed (%s); retrying in %.1fs", method, path, e, delay)
+            else:
+                self._record_quota(r.headers)
+                if r.status_code == 429:
+                    metrics.inc("trello_rate_limited_total")
+                if r.status_code < 400 or not self.retry.should_retry(attempt, method, r.status_code):
+                    r.raise_for_status()
+                    return r.json()
+                if r.status_code == 429:
+                    self.limiter.drain()
+                delay = self.retry.delay(attempt, r.headers.get("Retry-After"))
+                metrics.inc("trello_retries_total", reason=str(r.status_code))
+                logger.warning("Trello %s %s returned %s; retrying in %.1fs", method, path, r.status_code, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _record_quota(self, headers):
+        fractions = []
+        for scope in ("token", "key"):
+            remaining = headers.get(f"x-rate-limit-api-{scope}-remaining")
+            limit = headers.get(f"x-rate-limit-api-{scope}-max")
+            try:
+                fractions.append(int(remaining) / int(limit))
+            except (TypeError, ValueError, ZeroDivisionError):
+                continue
+        if fractions:
+            self.quota_remaining = min(fractions)
+            metrics.set("trello_quota_remaining", self.quota_remaining)
 
     def _get(self, path, params=None):
         if params is None:
             params = {}
         params.update({"key": self.key, "token": self.token})
-        url = f"{BASE}{path}"
-        r = requests.get(url, params=params, timeout=15)
-        r.raise_for_status()
-        return r.json()
+        return self._request("GET", path, params=params)
 
     def _post(self, path, data=None):
         if data is None:
             data = {}
         data.update({"key": self.key, "token": self.token})
-        url = f"{BASE}{path}"
-        r = requests.post(url, data=data, timeout=15)
-        r.raise_for_status()
-        return r.json()
+        return self._request("POST", path, data=data)
 
     def _put(self, path, data=None):
         if data is None:
             data = {}
         data.update({"key": self.key, "token": self.token})
-        url = f"{BASE}{path}"
-        r = requests.put(url, data=data, timeout=15)
-        r.raise_for_status()
-        return r.json()
+        return self._request("PUT", path, data=data)
 
+    @_timed("get_lists_by_name")
     def get_lists_by_name(self) -> Dict[str, str]:
         lists = self._get(f"/boards/{self.board_id}/lists")
         name_map = {}
@@ -68,6 +140,7 @@ class TrelloClient:
                 self.lists[lname] = created.get("id")
         return self.lists
 
+    @_timed("create_card")
     def create_card(self, list_name: str, card_name: str, desc: str = "") -> str:
         lname = list_name.lower().strip()
         if not self.lists:
@@ -79,79 +152,142 @@ class TrelloClient:
         card = self._post("/cards", data)
         return card.get("id")
 
+    @_timed("get_card")
     def get_card(self, card_id: str) -> dict:
-        return self._get(f"/cards/{card_id}")
+        return self._get(f"/cards/{card_id}", {"fields": CARD_FIELDS})
+
+    @_timed("find_open_card")
+    def find_open_card(self, card_id: str) -> Optional[dict]:
+        # None when the card was deleted or archived, matching what get_cards_on_board would omit.
+        try:
+            card = self.get_card(card_id)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+        if card.get("closed"):
+            return None
+        return card
 
+    @_timed("create_webhook")
+    def create_webhook(self, callback_url: str, description: str = "lead sync") -> dict:
+        data = {"callbackURL": callback_url, "idModel": self.board_id, "description": description}
+        return self._post("/webhooks", data)
+
+    @_timed("update_card_name")
     def update_card_name(self, card_id: str, new_name: str) -> dict:
         return self._put(f"/cards/{card_id}", data={"name": new_name})
 
-    def update_card_fields(self, card_id: str, new_fields: Dict[str, str]) -> dict:
-        card = self.get_card(card_id)
-        current_desc = card.get("desc") or ""
-        parsed = self.parse_desc_to_fields(current_desc)
+    def _list_id(self, list_name: str) -> str:
+        if not self.lists:
+            self.get_lists_by_name()
+        lname = list_name.lower().strip()
+        if lname not in self.lists:
+            raise RuntimeError(f"Destination list '{list_name}' not found")
+        return self.lists[lname]
+
+    @_timed("apply_card_patch")
+    def apply_card_patch(self, card_id: str, name: Optional[str] = None, list_name: Optional[str] = None,
+                         fields: Optional[Dict[str, str]] = None, card: Optional[dict] = None) -> dict:
+        # One PUT for title, list and description. `fields` holds only the email/note/source values
+        # to change; they are merged into the card's current description so fields edited on Trello
+        # are kept. That takes a GET of the card unless `card` is a copy the caller just read.
+        data = {}
+        if name is not None:
+            data["name"] = name
+        if list_name is not None:
+            data["idList"] = self._list_id(list_name)
+        if fields is not None:
+            if card is None:
+                card = self.get_card(card_id)
+            merged = self.parse_desc_to_fields(card.get("desc") or "")
+            merged.update({k.strip().lower(): v for k, v in fields.items()})
+            data["desc"] = self.render_fields_to_desc(merged)
+        if not data:
+            return {"id": card_id}
+        return self._put(f"/cards/{card_id}", data=data)
+
+    @_timed("update_card_fields")
+    def update_card_fields(self, card_id: str, new_fields: Dict[str, str],
+                           current_fields: Optional[Dict[str, str]] = None) -> dict:
+        # Pass current_fields (e.g. from the mapping) to skip the GET of the card description.
+        if current_fields is None:
+            card = self.get_card(card_id)
+            parsed = self.parse_desc_to_fields(card.get("desc") or "")
+        else:
+            parsed = {k.strip().lower(): str(v).strip() for k, v in current_fields.items() if v is not None}
 
         for k, v in new_fields.items():
             if v is None:
                 continue
             parsed[k.strip().lower()] = str(v).strip()
 
-        canon = {}
-        if "email" in parsed:
-            canon["Email"] = parsed["email"]
-        if "note" in parsed:
-            canon["Note"] = parsed["note"]
-        if "source" in parsed:
-            canon["Source"] = parsed["source"]
-
-        new_desc = self.render_fields_to_desc(canon)
+        new_desc = self.render_fields_to_desc(parsed)
         return self._put(f"/cards/{card_id}", data={"desc": new_desc})
 
+    @_timed("move_card")
     def move_card(self, card_id: str, dest_list_name: str) -> dict:
-        if not self.lists:
-            self.get_lists_by_name()
-        lname = dest_list_name.lower().strip()
-        if lname not in self.lists:
-            raise RuntimeError(f"Destination list '{dest_list_name}' not found")
-        dest_list_id = self.lists[lname]
-        return self._put(f"/cards/{card_id}", data={"idList": dest_list_id})
+        return self.apply_card_patch(card_id, list_name=dest_list_name)
 
     def get_cards_on_board(self) -> List[dict]:
-        return self._get(f"/boards/{self.board_id}/cards")
+        return list(self.iter_cards_on_board())
+
+    @_timed_iter("get_cards_on_board")
+    def iter_cards_on_board(self, page_size: int = CARD_PAGE_SIZE) -> Iterator[dict]:
+        # Only the fields the sync reads. With page_size > 0 the board is paged with before/limit
+        # (oldest id of each page) and cards are yielded page by page instead of in one response.
+        # Timed as get_cards_on_board, without the time the caller spends on each card.
+        params = {"fields": CARD_FIELDS}
+        if page_size <= 0:
+            yield from self._get(f"/boards/{self.board_id}/cards", params)
+            return
+        seen = set()
+        before = None
+        while True:
+            page_params = dict(params, limit=page_size)
+            if before:
+                page_params["before"] = before
+            page = self._get(f"/boards/{self.board_id}/cards", page_params)
+            for card in page:
+                if card.get("id") not in seen:
+                    seen.add(card.get("id"))
+                    yield card
+            if len(page) < page_size:
+                return
+            before = min(card.get("id") for card in page)
+
+    @_timed("get_board_actions")
+    def get_board_actions(self, since: Optional[str] = None, filter: str = CARD_ACTION_FILTER,
+                          limit: int = 1000) -> List[dict]:
+        # Newest first. Pages back with `before` until everything after `since` has been read.
+        actions: List[dict] = []
+        seen = set()
+        before = None
+        while True:
+            params = {"filter": filter, "limit": limit, "fields": "id,type,date,data"}
+            if since:
+                params["since"] = since
+            if before:
+                params["before"] = before
+            page = self._get(f"/boards/{self.board_id}/actions", params)
+            for a in page:
+                if a.get("id") not in seen:
+                    seen.add(a.get("id"))
+                    actions.append(a)
+            if len(page) < limit or not since:
+                return actions
+            before = page[-1].get("id")
 
+    @_timed("archive_card")
     def archive_card(self, card_id: str) -> dict:
         return self._put(f"/cards/{card_id}", data={"closed": "true"})
 
+    # Description format lives in desc_codec; these stay as the client's API.
     def render_fields_to_desc(self, fields: Dict[str, str]) -> str:
-        parts = []
-        if any(k.lower() == "email" for k in fields.keys()):
-            parts.append(f"Email: {fields.get('email') or fields.get('Email')}")
-        if any(k.lower() == "note" for k in fields.keys()):
-            parts.append(f"Note: {fields.get('note') or fields.get('Note')}")
-        if any(k.lower() == "source" for k in fields.keys()):
-            parts.append(f"Source: {fields.get('source') or fields.get('Source')}")
-        return "\n".join([p for p in parts if p is not None])
-
-    
+        return render_desc(fields)
 
     def parse_desc_to_fields(self, desc: str) -> Dict[str, str]:
-        result: Dict[str, str] = {}
-        if not desc:
-            return result
+        return parse_desc(desc)
 
-        for line in desc.splitlines():
-            if ":" not in line:
-                continue
-            key, val = line.split(":", 1)
-            k = key.strip().lower()
-            v = val.strip()
-            if v == "":
-                continue
-            if k == "email":
-               result[k] = self.extract_email(v)   
-            elif k in ("note", "source"):
-               result[k] = v 
-        return result
-
-    def extract_email(self,text: str) -> str:
-       m = re.search(r'([A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,})', text)
-       return m.group(1) if m else text
\ No newline at end of file
+    def extract_email(self, text: str) -> str:
+        return extract_email(text)
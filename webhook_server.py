@@ -0,0 +1,166 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Set
+
+logger = logging.getLogger("sync")
+
+
+class ChangeSet:
+    def __init__(self, card_ids: Set[str], sheet_ids: Set[str], sheet_dirty: bool):
+        self.card_ids = card_ids
+        self.sheet_ids = sheet_ids
+        # Set by pings that don't say which rows changed (Drive push notifications).
+        self.sheet_dirty = sheet_dirty
+
+    def __bool__(self):
+        return bool(self.card_ids or self.sheet_ids or self.sheet_dirty)
+
+
+class ChangeQueue:
+    # Collects changed card/row ids from the receiver thread until the sync loop drains them.
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.card_ids: Set[str] = set()
+        self.sheet_ids: Set[str] = set()
+        self.sheet_dirty = False
+
+    def add_card(self, card_id: str):
+        with self.cond:
+            self.card_ids.add(card_id)
+            self.cond.notify_all()
+
+    def add_sheet_ids(self, ids):
+        with self.cond:
+            self.sheet_ids.update(str(i).strip() for i in ids if str(i).strip() != "")
+            self.cond.notify_all()
+
+    def mark_sheet_dirty(self):
+        with self.cond:
+            self.sheet_dirty = True
+            self.cond.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> ChangeSet:
+        # Waits up to `timeout` seconds for something to arrive, then takes everything queued so far.
+        with self.cond:
+            if timeout and not (self.card_ids or self.sheet_ids or self.sheet_dirty):
+                self.cond.wait(timeout)
+            changes = ChangeSet(self.card_ids, self.sheet_ids, self.sheet_dirty)
+            self.card_ids, self.sheet_ids, self.sheet_dirty = set(), set(), False
+            return changes
+
+
+def trello_signature(secret: str, body: bytes, callback_url: str) -> str:
+    digest = hmac.new(secret.encode(), body + callback_url.encode(), hashlib.sha1).digest()
+    return base64.b64encode(digest).decode()
+
+
+def card_id_from_trello_payload(payload: dict) -> Optional[str]:
+    card = ((payload.get("action") or {}).get("data") or {}).get("card") or {}
+    return card.get("id")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    receiver = None  # set on the per-server subclass
+
+    def log_message(self, fmt, *args):
+        logger.debug("webhook %s", fmt % args)
+
+    def _reply(self, code: int):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    # Trello sends HEAD to the callback URL when the webhook is created.
+    def do_HEAD(self):
+        self._reply(200 if self.path.startswith("/trello") else 404)
+
+    def do_GET(self):
+        self.do_HEAD()
+
+    def do_POST(self):
+        body = self._body()
+        if self.path.startswith("/trello"):
+            code = self.receiver.handle_trello(body, self.headers.get("X-Trello-Webhook"))
+        elif self.path.startswith("/sheet"):
+            code = self.receiver.handle_sheet(body, self.headers)
+        else:
+            code = 404
+        self._reply(code)
+
+
+# Small HTTP endpoint that turns Trello webhooks and sheet pings into queued ids:
+#   POST /trello  Trello webhook payloads; the action's card id is queued.
+#   POST /sheet   Apps Script pings with {"ids": [...]} queue those rows; an empty body or a
+#                 Drive push notification marks the whole sheet for a full pass.
+class WebhookReceiver:
+    def __init__(self, queue: ChangeQueue, host: str = "127.0.0.1", port: int = 8080,
+                 trello_secret: Optional[str] = None, trello_callback_url: Optional[str] = None,
+                 sheet_token: Optional[str] = None):
+        self.queue = queue
+        self.trello_secret = trello_secret
+        self.trello_callback_url = trello_callback_url
+        self.sheet_token = sheet_token
+        handler = type("WebhookHandler", (_Handler,), {"receiver": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="webhook-receiver", daemon=True)
+        self.thread.start()
+        logger.info("Webhook receiver listening on %s:%s", *self.server.server_address[:2])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle_trello(self, body: bytes, signature: Optional[str]) -> int:
+        if self.trello_secret and self.trello_callback_url:
+            expected = trello_signature(self.trello_secret, body, self.trello_callback_url)
+            if not signature or not hmac.compare_digest(expected, signature):
+                logger.warning("Rejected Trello webhook with bad signature")
+                return 401
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return 400
+        if not isinstance(payload, dict):
+            return 400
+        card_id = card_id_from_trello_payload(payload)
+        if card_id:
+            self.queue.add_card(card_id)
+        return 200
+
+    def handle_sheet(self, body: bytes, headers) -> int:
+        if self.sheet_token:
+            token = headers.get("X-Goog-Channel-Token") or headers.get("X-Sync-Token")
+            if not token or not hmac.compare_digest(token, self.sheet_token):
+                logger.warning("Rejected sheet ping with bad token")
+                return 401
+        if headers.get("X-Goog-Resource-State") == "sync":
+            # Drive sends this once when the channel is opened; nothing changed yet.
+            return 200
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return 400
+        ids = payload.get("ids") if isinstance(payload, dict) else None
+        if isinstance(ids, (str, int)):
+            ids = [ids]
+        if ids:
+            self.queue.add_sheet_ids(ids)
+        else:
+            self.queue.mark_sheet_dirty()
+        return 200